@@ -0,0 +1,242 @@
+# end-to-end load test against local stand-ins,
+# usage: python -m benchmarks.run --players 200 --rounds 20
+#
+# the app is served by an in-process uvicorn, so client and server
+# share one CPU; compare results from the same machine only
+
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+
+from . import standins
+
+import aiohttp
+import uvicorn
+
+from pathlib import Path
+from collections import defaultdict
+from statistics import quantiles
+from typing import Optional
+
+RESULTS = Path(__file__).parent / 'results'
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.spans: dict[str, list[float]] = {}
+
+    def add(self, name: str, started: float) -> None:
+        now = time.perf_counter()
+        self.samples[name].append(now - started)
+
+        span = self.spans.setdefault(name, [started, now])
+        span[0], span[1] = min(span[0], started), max(span[1], now)
+
+    def report(self) -> dict[str, dict]:
+        result = {}
+        for name, samples in sorted(self.samples.items()):
+            ms = sorted(s * 1000 for s in samples)
+            cuts = quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+            wall = self.spans[name][1] - self.spans[name][0]
+
+            result[name] = {
+                'count': len(ms),
+                'throughput': len(ms) / wall if wall else None,
+                'mean_ms': sum(ms) / len(ms),
+                'p50_ms': cuts[49],
+                'p95_ms': cuts[94],
+                'p99_ms': cuts[98]
+            }
+        return result
+
+
+class Player:
+    def __init__(self, http: aiohttp.ClientSession, rec: Recorder, n: int):
+        self.n = n
+        self.http = http
+        self.rec = rec
+
+        self.id: Optional[int] = None
+        self.token: Optional[str] = None
+
+    async def call(self, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        async with self.http.request(method, url, **kwargs) as resp:
+            data = await resp.json()
+            if resp.status >= 400:
+                raise RuntimeError(f'{name}: {resp.status} {data}')
+
+        self.rec.add(name, started)
+        return data
+
+    @property
+    def auth(self) -> dict[str, str]:
+        return {'Authorization': f'Bearer {self.token}'}
+
+    async def signup(self, run: str, me_calls: int) -> None:
+        from src.apps.security import create_token
+
+        email = f'bench-{run}-{self.n}@gmail.com'
+        creds = {'email': email, 'password': f'secret-{self.n}'}
+
+        data = await self.call(
+            'register', 'POST', '/users/register',
+            json={'name': f'player {self.n}', **creds}
+        )
+        self.id = data['user']['_id']
+
+        verify = create_token(self.id, 'verify')
+        await self.call('verify', 'GET', f'/users/verify/{verify}')
+
+        data = await self.call('login', 'POST', '/users/login', json=creds)
+        self.token = data['token']
+
+        for _ in range(me_calls):
+            await self.call('me', 'GET', '/users/me', headers=self.auth)
+
+    async def play(self, game_id: str, rounds: int) -> None:
+        async with self.http.ws_connect(f'/games/ws/{game_id}') as ws:
+            await ws.receive_json()  # init
+
+            for _ in range(rounds):
+                for action, reply in (('roll', 'rolled'), ('buy', 'bought')):
+                    started = time.perf_counter()
+                    await ws.send_json({
+                        'action': action, 'player_id': self.id
+                    })
+
+                    # skip events caused by the other players
+                    while True:
+                        msg = await ws.receive_json()
+                        if msg.get('type') == reply \
+                                and msg.get('player_id') == self.id:
+                            break
+
+                    self.rec.add(f'ws.{action}', started)
+
+
+async def table(players: list[Player], size: int, rounds: int) -> None:
+    host, *guests = players
+
+    data = await host.call(
+        'create_game', 'POST', f'/games/?max_players={size}',
+        headers=host.auth
+    )
+    game_id = data['game_id']
+
+    for guest in guests:
+        await guest.call(
+            'join_game', 'POST',
+            f'/games/{game_id}/join?player_id={guest.id}'
+        )
+
+    await asyncio.gather(*(p.play(game_id, rounds) for p in players))
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    app = standins.install()
+
+    server = uvicorn.Server(uvicorn.Config(
+        app, host='127.0.0.1', port=0, log_level='warning'
+    ))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    port = server.servers[0].sockets[0].getsockname()[1]
+    rec = Recorder()
+    run = str(time.time_ns())
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(
+        f'http://127.0.0.1:{port}', connector=connector
+    ) as http:
+        players = [Player(http, rec, n) for n in range(args.players)]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(p.signup(run, args.me) for p in players))
+
+        size = args.table
+        await asyncio.gather(*(
+            table(players[i:i + size], size, args.rounds)
+            for i in range(0, len(players) - size + 1, size)
+        ))
+        elapsed = time.perf_counter() - started
+
+    server.should_exit = True
+    await serving
+
+    return {
+        'commit': _commit(),
+        'created_at': int(time.time()),
+        'params': vars(args),
+        'elapsed_s': elapsed,
+        'endpoints': rec.report()
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _change(was: dict, cur: dict, key: str) -> str:
+    if cur[key] is None or was[key] is None:
+        return '-'
+    return f'{was[key]:.1f}->{cur[key]:.1f}'
+
+
+def compare(old: dict, new: dict) -> None:
+    print(f'{"endpoint":<14} {"p50 ms":>16} {"p99 ms":>16} {"req/s":>16}')
+    for name, cur in new['endpoints'].items():
+        was = old['endpoints'].get(name)
+        if not was:
+            continue
+
+        print(f'{name:<14} {_change(was, cur, "p50_ms"):>16} '
+              f'{_change(was, cur, "p99_ms"):>16} '
+              f'{_change(was, cur, "throughput"):>16}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--table', type=int, default=4,
+                        help='players per game (max_players)')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='roll + buy rounds per player')
+    parser.add_argument('--me', type=int, default=5,
+                        help='/users/me calls per player')
+    parser.add_argument('--name', type=str, default=None,
+                        help='result file name (default: commit hash)')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='earlier result file to compare with')
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+
+    RESULTS.mkdir(exist_ok=True)
+    path = RESULTS / f'{args.name or result["commit"] or "latest"}.json'
+    path.write_text(json.dumps(result, indent=2))
+
+    print(f'{"endpoint":<14} {"count":>7} {"req/s":>9} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, stat in result['endpoints'].items():
+        print(f'{name:<14} {stat["count"]:>7} {stat["throughput"]:>9.1f} '
+              f'{stat["p50_ms"]:>8.2f} {stat["p95_ms"]:>8.2f} '
+              f'{stat["p99_ms"]:>8.2f}')
+    print(f'saved to {path}')
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), result)
+
+
+if __name__ == '__main__':
+    main()
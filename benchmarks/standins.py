@@ -0,0 +1,96 @@
+# local stand-ins for every external service the app talks to,
+# installed before `main` is imported
+
+import os
+
+os.environ.setdefault('AWS_ACCESS_KEY', 'bench')
+os.environ.setdefault('AWS_SECRET_KEY', 'bench')
+
+import fakeredis
+import mongomock.collection
+
+from types import SimpleNamespace
+from mongomock_motor import AsyncMongoMockClient
+
+
+def _bulk_write(self, requests, ordered=True, **kwargs):
+    # mongomock does not understand pymongo>=4.9 bulk operations,
+    # delta.persist and the outbox only send UpdateOne requests
+    matched = 0
+    for request in requests:
+        result = self.update_one(
+            request._filter, request._doc, upsert=request._upsert
+        )
+        matched += result.matched_count
+    return SimpleNamespace(matched_count=matched)
+
+
+class MemoryS3:
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def upload(self, bytes, filename, object_id,
+                     category='avatars', content_type=None):
+        self.objects[f'{category}/{object_id}/{filename}'] = bytes
+
+    async def download(self, filename, object_id, category='avatars',
+                       max_size=None):
+        return self.objects.get(f'{category}/{object_id}/{filename}')
+
+    async def exists(self, filename, object_id, category='avatars'):
+        return f'{category}/{object_id}/{filename}' in self.objects
+
+    async def list_objects(self, object_id, category='avatars'):
+        prefix = f'{category}/{object_id}/'
+        return [k for k in self.objects if k.startswith(prefix)]
+
+    async def delete_object(self, object_id, filename, category='avatars'):
+        self.objects.pop(f'{category}/{object_id}/{filename}', None)
+
+    async def delete_objects(self, keys):
+        for key in keys:
+            self.objects.pop(key, None)
+
+
+class MemoryMail:
+    batch_size = 100
+
+    def __init__(self):
+        self.sent: list[tuple[str, str]] = []
+
+    async def send(self, messages):
+        self.sent += [(m.to, m.subject) for m in messages]
+        return [str(m.id) for m in messages]
+
+
+def install():
+    import main
+    from src.services import cache
+    from src.services import s3client
+    from src.apps.users import avatars, routes as users
+
+    mongomock.collection.Collection.bulk_write = _bulk_write
+
+    async def init_redis(_: str) -> None:
+        cache.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    async def email_exists(_: str) -> bool:
+        return True
+
+    main.AsyncIOMotorClient = lambda _: AsyncMongoMockClient()
+    main.init_redis = init_redis
+    main.config.redis_uri = 'redis://bench'
+
+    users.email_exists = email_exists
+    main.outbox.provider = MemoryMail()
+
+    s3 = MemoryS3()
+    s3client.s3 = users.s3 = avatars.s3 = main.s3 = s3
+
+    return main.app
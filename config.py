@@ -31,11 +31,73 @@ class Config(BaseSettings):
     # redis (conf)
     redis_uri: Optional[str] = None
 
+    # read-through cache (in-process L1 + redis L2), seconds
+    cache_l1_size: int = 10000
+    cache_l1_ttl: int = 5
+    cache_ttl: int = 60
+    cache_negative_ttl: int = 5
+
+    # websocket broadcast backend: local (one worker) or redis
+    ws_backend: str = 'local'
+    ws_queue_size: int = 64  # outbound messages buffered per socket
+    ws_send_timeout: int = 5000  # ms, slower clients are evicted
+
+    # JSON encoder for responses and websocket frames: orjson or json
+    json_encoder: str = 'orjson'
+
+    # snowflake IDs: datacenter 0-3, worker 0-15 (leased in redis
+    # when not set, one per process)
+    snowflake_datacenter: int = 0
+    snowflake_worker: Optional[int] = None
+    snowflake_max_lead: int = 1000  # ms IDs may run ahead of the clock
+    snowflake_lease_ttl: int = 30000  # ms
+
     # origins for CORS
     allowed_origin: Optional[str] = '*'
 
     # jwt secret key
     jwt_secret: str = 'your-jwt-secret-key'
+    token_cache_size: int = 10000  # verified tokens kept in memory
+    token_cache_ttl: int = 300  # seconds
+
+    # password hashing (scrypt in a process pool)
+    password_workers: int = 2
+    password_max_pending: int = 64  # beyond that requests get 503
+    password_scrypt_n: int = 2 ** 14
+    password_scrypt_r: int = 8
+    password_scrypt_p: int = 1
+
+    # avatar variants (WebP, resized in a process pool)
+    avatar_sizes: tuple[int, ...] = (64, 128, 256)
+    avatar_quality: int = 80
+    image_workers: int = 2
+    image_max_pending: int = 32  # beyond that requests get 503
+    # presigned uploads are resized out of band by
+    # `python -m src.apps.users.avatars`, or inside the API
+    # workers with avatar_worker_in_app (single-process setups)
+    avatar_worker_in_app: bool = False
+    avatar_poll_interval: float = 1.0  # seconds between idle polls
+    avatar_lease: int = 60  # a claimed upload is hidden that long
+    avatar_max_attempts: int = 3
+
+    # email existence check (external API)
+    email_check_url: str = 'https://api.2ip.ua/email.json'
+    email_check_timeout: float = 3  # seconds, slower counts as failed
+    email_check_fallback: bool = False  # verdict while the API is down
+    email_cache_size: int = 10000
+    email_cache_ttl: int = 86400  # verdict per address, seconds
+    email_domain_ttl: int = 3600  # domains with a confirmed address
+    email_breaker_failures: int = 5  # failures in a row to open
+    email_breaker_reset: float = 30  # seconds until a trial request
+    email_proxy_cooldown: float = 60  # a failed proxy sits out, seconds
+
+    # email outbox (sent by background workers), seconds
+    email_provider: str = 'resend'  # resend, or log to just log them
+    email_workers: int = 2  # provider calls at once
+    email_poll_interval: float = 5  # look for due retries
+    email_lease: int = 60  # a claimed message is hidden that long
+    email_max_attempts: int = 5
+    email_backoff: int = 30  # doubled after every failed attempt
 
     # resend conf
     resend_sender: Optional[str] = 'support@monopoliya.fun'
@@ -48,6 +110,28 @@ class Config(BaseSettings):
     aws_access_key: str
     aws_secret_key: str
 
+    # one pooled S3 client for the whole process, seconds
+    aws_max_pool_connections: int = 20
+    aws_connect_timeout: float = 5
+    aws_read_timeout: float = 30
+    aws_presign_expires: int = 300  # presigned avatar upload, seconds
+
+    # game lobby
+    lobby_count_ttl: int = 10  # seconds the waiting games count is cached
+
+    # matchmaking (redis), groups are formed every interval seconds
+    matchmaking_interval: float = 0.5
+    matchmaking_batch: int = 50  # games formed per size and pass
+
+    # live game engine (write-behind to MongoDB)
+    game_flush_actions: int = 20  # flush after N actions
+    game_flush_interval: int = 1000  # or after T milliseconds
+    game_snapshot_every: int = 100  # full snapshot every K events
+    # with redis a live room belongs to one worker, leased for this
+    # long (ms) and renewed. Other workers refuse its sockets and
+    # joins, so route /games/{game_id}/... by game id (sticky)
+    game_lease_ttl: int = 15000
+
     class Config:
         env_file = '.env'
         env_file_encoding = 'utf-8'
@@ -1,5 +1,17 @@
 from config import config
 from src.services.cache import init_redis
+from src.services.indexes import ensure_indexes
+from src.services.passwords import hasher
+from src.services.s3client import s3
+from src.services.images import images
+from src.services.email import verifier
+from src.services.outbox import outbox
+from src.services.snowflake import snowflake
+from src.encoder import FastJSONResponse
+from src.apps.websocket import manager
+from src.apps.games.engine import engine
+from src.apps.games.matchmaking import matchmaker
+from src.apps.users.avatars import avatars
 
 # routes imports
 from src.apps import games, users
@@ -14,27 +26,62 @@ from beanie import init_beanie
 from contextlib import asynccontextmanager
 from motor.motor_asyncio import AsyncIOMotorClient
 
+DOCUMENT_MODELS = [
+    'src.apps.users.models.User',
+    'src.apps.games.models.Game',
+    'src.apps.games.models.GameEvent',
+    'src.apps.games.models.GameSnapshot',
+    'src.services.outbox.EmailMessage',
+    'src.apps.users.avatars.AvatarJob',
+]
+
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     client = AsyncIOMotorClient(config.mongo_uri)
-    await init_beanie(database=client.monopoly, document_models=[
-        'src.apps.users.models.User',
-        'src.apps.games.models.Game',
-    ])
+    await init_beanie(
+        database=client.monopoly,
+        document_models=DOCUMENT_MODELS,
+        skip_indexes=True
+    )
+    # declared indexes, one by one, with a report of the differences
+    await ensure_indexes(DOCUMENT_MODELS)
 
     if config.redis_uri:
         # Initialize Redis if a URI is provided
         await init_redis(config.redis_uri)
 
+    await snowflake.start()  # leases a worker id from redis
+    await manager.start()
+    engine.start()
+    matchmaker.start()  # only with redis
+    hasher.start()
+    images.start()
+    await s3.start()
+    await verifier.start()
+    outbox.start()
+    if config.avatar_worker_in_app:
+        avatars.start()  # otherwise python -m src.apps.users.avatars
+
     yield
 
+    await engine.close()  # flush live games
+    await outbox.close()
+    await avatars.close()
+    await matchmaker.close()
+    await manager.close()
+    hasher.close()
+    images.close()
+    await s3.close()
+    await verifier.close()
+    await snowflake.close()
     client.close()  # close MongoDB connection
 
 
 app = FastAPI(
     lifespan=lifespan,
     debug=config.debug,
+    default_response_class=FastJSONResponse,
     title='Monopoly Game API',
     description='API For the Monopoly Game Server',
     docs_url='/docs' if config.debug else None,
@@ -1,5 +1,5 @@
 from src.logger import get_logger
-from src.apps.security import decode
+from src.apps.security import verify
 
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, \
@@ -20,7 +20,7 @@ def login_required(
     if header.scheme.lower() != 'bearer':
         raise HTTPException(403, 'Forbidden')
 
-    payload = decode(header.credentials)
+    payload = verify(header.credentials)
     return payload
 
 
@@ -0,0 +1,127 @@
+import uuid
+
+from .models import Game
+
+from typing import Any
+from pymongo import UpdateOne
+
+__all__ = ('Delta', 'persist')
+
+
+def _overlaps(a: str, b: str) -> bool:
+    # mongo rejects one update touching both "x" and "x.y"
+    return a == b or a.startswith(f'{b}.') or b.startswith(f'{a}.')
+
+
+class Delta:
+    # field-level changes of a game, recorded by GameService
+    # and written as targeted $set/$push updates
+
+    __slots__ = ('_ops',)
+
+    def __init__(self):
+        self._ops: list[tuple[str, str, Any]] = []
+
+    def __bool__(self) -> bool:
+        return bool(self._ops)
+
+    def __len__(self) -> int:
+        return len(self._ops)
+
+    def set(self, path: str, value: Any) -> None:
+        self._ops.append(('$set', path, value))
+
+    def push(self, path: str, value: Any) -> None:
+        self._ops.append(('$push', path, value))
+
+    def merge(self, other: 'Delta') -> None:
+        self._ops.extend(other._ops)
+
+    def updates(self) -> list[dict[str, dict]]:
+        # fold the changes into as few update documents as possible,
+        # a new one is started only when a path would conflict
+        updates: list[dict[str, dict]] = []
+        current: dict[str, dict] = {}
+
+        for op, path, value in self._ops:
+            conflict = any(
+                _overlaps(path, other)
+                for other_op, fields in current.items()
+                for other in fields
+                # repeated $set of the same path simply overwrites
+                if not (other_op == op == '$set' and other == path)
+                # repeated $push of the same path is merged via $each
+                and not (other_op == op == '$push' and other == path)
+            )
+
+            if conflict:
+                updates.append(current)
+                current = {}
+
+            fields = current.setdefault(op, {})
+            if op == '$set':
+                fields[path] = value
+            else:
+                fields.setdefault(path, {'$each': []})['$each'].append(value)
+
+        if current:
+            updates.append(current)
+        return updates
+
+
+async def persist(game: Game, delta: Delta) -> bool:
+    # optimistic write: the version it expects is checked, and bumped
+    # once per update, returns False when the stored version moved on
+    updates = delta.updates()
+    if game._converted:
+        # first write of a legacy document: store the whole array,
+        # a lone "owners.N" on a missing field makes mongo create an
+        # object, which no longer loads
+        updates.insert(0, {
+            '$set': {'owners': game.owners},
+            '$unset': {'board': ''}
+        })
+    if not updates:
+        return True
+
+    version = game.version
+    requests: list[tuple[dict, dict]] = []
+    # an ordered bulk write goes on after an update that matched
+    # nothing, so only the first one checks the version. It stamps
+    # a token the later ones filter on, they can't land on a document
+    # someone else wrote in between. The last one removes it again
+    token = uuid.uuid4().hex if len(updates) > 1 else None
+
+    for i, update in enumerate(updates):
+        version += 1
+        update.setdefault('$set', {})['version'] = version
+
+        if i == 0:
+            # documents created before versioning have no field at all
+            expected = game.version if game.version \
+                else {'$in': [None, 0]}
+            query = {'_id': game.id, 'version': expected}
+            if token is not None:
+                update['$set']['write_token'] = token
+        else:
+            query = {'_id': game.id, 'write_token': token}
+            if i == len(updates) - 1:
+                update.setdefault('$unset', {})['write_token'] = ''
+
+        requests.append((query, update))
+
+    collection = Game.get_motor_collection()
+    if len(requests) == 1:
+        result = await collection.update_one(*requests[0])
+    else:
+        # still one round-trip, applied in order
+        result = await collection.bulk_write([
+            UpdateOne(*request) for request in requests
+        ], ordered=True)
+
+    if result.matched_count != len(requests):
+        return False
+
+    game.version = version
+    game._converted = False
+    return True
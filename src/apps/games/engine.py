@@ -0,0 +1,418 @@
+import time
+import uuid
+import asyncio
+import inspect
+
+from functools import partial
+
+from .models import Game, GameEvent
+from .delta import Delta, persist
+from . import events
+
+from config import config
+from src.services import cache
+from src.logger import get_logger
+from src.apps.websocket import manager
+
+from typing import Callable, Optional, TypeVar
+from beanie import PydanticObjectId
+
+logger = get_logger(__name__)
+
+T = TypeVar('T')
+
+# renews the rooms this worker owns, takes back the ones that expired
+# meanwhile, returns the keys someone else owns now
+_RENEW = '''
+local lost = {}
+for _, key in ipairs(KEYS) do
+    local owner = redis.call('get', key)
+    if owner == ARGV[1] then
+        redis.call('pexpire', key, ARGV[2])
+    elseif not owner then
+        redis.call('set', key, ARGV[1], 'PX', ARGV[2])
+    else
+        table.insert(lost, key)
+    end
+end
+return lost
+'''
+_RELEASE = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+class RoomOwnedError(RuntimeError):
+    pass
+
+
+def _owner_key(game_id: str) -> str:
+    return f'game:owner:{game_id}'
+
+
+class LiveGame:
+    # authoritative in-memory state of one game room, owned by
+    # a single actor task that applies queued actions in order
+
+    __slots__ = (
+        'delta', 'epoch', 'events', 'flushed_at', 'game', 'lock',
+        'mailbox', 'pending', 'refs', 'saved', 'task'
+    )
+
+    def __init__(self, game: Game):
+        self.game = game
+        self.delta = Delta()  # changes not written yet
+        self.events: list[GameEvent] = []  # log entries not written yet
+        self.lock = asyncio.Lock()  # one flush at a time
+
+        self.mailbox: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+        self.pending = 0  # actions applied but not persisted yet
+        self.saved = game.seq  # last event the stored document holds
+        self.epoch = 0  # bumped when the local state is thrown away
+        self.refs = 0  # sockets and requests using the room
+        self.flushed_at = time.monotonic()
+
+    def record(self, type: str, data: list[int]) -> None:
+        # log an applied action, called from inside the actor
+        self.game.seq += 1
+        self.delta.set('seq', self.game.seq)
+
+        self.events.append(GameEvent(
+            id=PydanticObjectId(),  # known before insert, see _reload
+            game_id=self.game.id,
+            seq=self.game.seq,
+            type=type,
+            data=data
+        ))
+
+
+class GameEngine:
+    def __init__(
+        self,
+        flush_actions: int,
+        flush_interval: int,
+        snapshot_every: int,
+        lease_ttl: int
+    ):
+        self.flush_actions = flush_actions
+        self.flush_interval = flush_interval / 1000  # ms -> sec
+        self.snapshot_every = snapshot_every
+        self.lease_ttl = lease_ttl
+
+        # with several workers each live room has one owner, other
+        # workers' actors would apply actions over each other
+        self._token = uuid.uuid4().hex
+        self._renewed_at = time.monotonic()
+
+        self._games: dict[str, LiveGame] = {}
+        # one load per game, other rooms don't wait for it
+        self._loading: dict[str, asyncio.Task] = {}
+
+        self._task: Optional[asyncio.Task] = None
+        self._flushes: set[asyncio.Task] = set()
+
+    def get(self, game_id: str) -> Optional[LiveGame]:
+        return self._games.get(game_id)
+
+    async def acquire(self, game_id: str) -> Optional[LiveGame]:
+        live = self._games.get(game_id)
+        if live is None:
+            # concurrent callers share the load of the same game
+            task = self._loading.get(game_id)
+            if task is None:
+                task = asyncio.create_task(self._load(game_id))
+                self._loading[game_id] = task
+                task.add_done_callback(
+                    lambda _: self._loading.pop(game_id, None)
+                )
+
+            # a cancelled caller doesn't cancel the load for the others
+            live = await asyncio.shield(task)
+            if live is None:
+                return None
+
+        live.refs += 1
+        return live
+
+    async def _load(self, game_id: str) -> Optional[LiveGame]:
+        if not await self._lease(game_id):
+            raise RoomOwnedError(f'Game {game_id} is live on another worker')
+
+        live = None
+        try:
+            # straight from the db, the actor's state is
+            # authoritative and a cached copy may be stale
+            game = await Game.get(game_id)
+            if game:
+                live = LiveGame(game)
+                # events logged before a crash, but not flushed
+                live.pending = await events.recover(game, live.delta)
+        finally:
+            if live is None:
+                await self._unlease(game_id)
+
+        if live is None:
+            return None
+
+        self._games[game_id] = live
+        live.task = asyncio.create_task(self._actor(live))
+        return live
+
+    async def release(self, game_id: str) -> None:
+        live = self._games.get(game_id)
+        if live is None:
+            return
+
+        live.refs -= 1
+        if live.refs > 0:
+            return
+
+        # nobody uses the room anymore, persist and unload
+        await self.flush(live)
+        if live.refs <= 0 and self._games.get(game_id) is live:
+            del self._games[game_id]
+            live.task.cancel()
+            await self._unlease(game_id)
+
+    async def _lease(self, game_id: str) -> bool:
+        if cache.redis is None:
+            return True  # a single worker
+
+        key = _owner_key(game_id)
+        if await cache.redis.set(
+            key, self._token, nx=True, px=self.lease_ttl
+        ):
+            return True
+        return await cache.redis.get(key) == self._token
+
+    async def _unlease(self, game_id: str) -> None:
+        if cache.redis is None:
+            return
+
+        try:
+            await cache.redis.eval(
+                _RELEASE, 1, _owner_key(game_id), self._token
+            )
+        except Exception as exc:
+            logger.error(f'Failed to release game {game_id}: {exc}')
+
+    async def owned_elsewhere(self, game_id: str) -> bool:
+        # live on another worker, its actor holds the state
+        if cache.redis is None:
+            return False
+
+        owner = await cache.redis.get(_owner_key(game_id))
+        return owner is not None and owner != self._token
+
+    async def _renew(self) -> None:
+        if cache.redis is None or not self._games:
+            return
+
+        keys = [_owner_key(game_id) for game_id in self._games]
+        try:
+            lost = await cache.redis.eval(
+                _RENEW, len(keys), *keys, self._token, self.lease_ttl
+            )
+        except Exception as exc:
+            logger.error(f'Failed to renew game leases: {exc}')
+            return
+
+        for key in lost:
+            await self._evict(key.removeprefix('game:owner:'))
+
+    async def _evict(self, game_id: str) -> None:
+        # the lease ran out and another worker loaded the room, its
+        # actor is authoritative now. Writing ours would only fail its
+        # version check, the unflushed actions are dropped instead
+        live = self._games.pop(game_id, None)
+        if live is None:
+            return
+
+        logger.error(
+            f'Game {game_id} was taken over by another worker, '
+            f'dropped {live.pending} unsaved actions'
+        )
+        live.task.cancel()
+        while not live.mailbox.empty():
+            _, future = live.mailbox.get_nowait()
+            if not future.done():
+                future.set_exception(RoomOwnedError(game_id))
+
+        # clients reconnect and get routed to the owner
+        await manager.close_room(game_id, code=1012)
+
+    async def submit(
+        self,
+        live: LiveGame,
+        action: Callable[[LiveGame], T]
+    ) -> T:
+        # queue an action for the room actor and wait for its result
+        future = asyncio.get_running_loop().create_future()
+        live.mailbox.put_nowait((action, future))
+        return await future
+
+    async def _actor(self, live: LiveGame) -> None:
+        while True:
+            action, future = await live.mailbox.get()
+            if future.cancelled():
+                continue
+
+            changes = len(live.delta)
+            try:
+                result = action(live)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as exc:
+                future.set_exception(exc)
+                continue
+
+            if len(live.delta) > changes:
+                self.commit(live)
+            future.set_result(result)
+
+    def commit(self, live: LiveGame) -> None:
+        # mark one applied action, persistence happens in background
+        live.pending += 1
+        if live.pending >= self.flush_actions:
+            task = asyncio.create_task(self.flush(live))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def flush(self, live: LiveGame) -> bool:
+        # True once everything applied before the call is stored,
+        # possibly by a flush that was already running
+        target, epoch = live.game.seq, live.epoch
+
+        async with live.lock:
+            if live.pending:
+                await self._flush(live)
+
+        return live.epoch == epoch and live.saved >= target
+
+    async def _flush(self, live: LiveGame) -> None:
+        pending, live.pending = live.pending, 0
+        delta, live.delta = live.delta, Delta()
+        logged, live.events = live.events, []
+
+        # snapshot the state whenever a multiple of K is crossed
+        state, seq = None, live.game.seq
+        if logged and (logged[0].seq - 1) // self.snapshot_every \
+                < seq // self.snapshot_every:
+            state = events.dump(live.game)
+
+        try:
+            # the log goes first, the document can be rebuilt from it
+            written = await events.append(logged) \
+                and await persist(live.game, delta)
+        except Exception:
+            # keep the order: failed changes go first
+            delta.merge(live.delta)
+            live.delta = delta
+            live.events = logged + live.events
+            live.pending += pending
+            logger.exception(f'Failed to flush game {live.game.id}')
+            return
+
+        live.flushed_at = time.monotonic()
+        if written:
+            live.saved = seq
+        if written and state is not None:
+            try:
+                await events.snapshot(live.game, state, seq)
+            except Exception:
+                logger.exception(f'Failed to snapshot {live.game.id}')
+        if not written:
+            # the stored version moved on without us,
+            # drop the local state and start over from the db
+            logger.warning(f'Version conflict in game {live.game.id}')
+            state = await self.submit(
+                live, partial(self._reload, orphans=logged)
+            )
+            # clients have seen actions that are gone now, resync
+            await manager.broadcast(
+                str(live.game.id), {'type': 'init', 'game': state}
+            )
+
+    async def adopt(self, game_id: str, doc: dict) -> None:
+        # the document was written outside the actor (atomic joins
+        # while the room wasn't loaded), a room loaded here meanwhile
+        # takes the stored state over
+        live = self._games.get(game_id)
+        if live is not None:
+            async with live.lock:  # not in the middle of a flush
+                await self.submit(live, partial(self._adopt, doc=doc))
+
+    @staticmethod
+    def _adopt(live: LiveGame, doc: dict) -> None:
+        # never over applied actions: with changes of its own the room
+        # keeps them, its next flush fails the version check instead
+        game = Game.model_validate(doc)
+        if game.version <= live.game.version or live.pending:
+            return
+        live.game = game
+        live.saved = game.seq
+
+    @staticmethod
+    async def _reload(live: LiveGame, orphans: list[GameEvent]) -> dict:
+        game = await Game.get(live.game.id)
+        if game is not None:
+            live.game = game
+
+        # logged by the failed flush but beyond the stored document
+        await events.discard([e for e in orphans if e.seq > live.game.seq])
+
+        live.delta = Delta()
+        live.events = []
+        live.pending = 0
+        live.saved = live.game.seq
+        live.epoch += 1
+        return live.game.to_dict()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+
+            now = time.monotonic()
+            await asyncio.gather(*(
+                self.flush(live) for live in list(self._games.values())
+                if live.pending and
+                now - live.flushed_at >= self.flush_interval
+            ))
+
+            if now - self._renewed_at >= self.lease_ttl / 3000:
+                self._renewed_at = now
+                await self._renew()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # wait for in-flight flushes, then persist everything left
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await asyncio.gather(*(
+            self.flush(live) for live in self._games.values()
+        ))
+
+        for game_id, live in self._games.items():
+            live.task.cancel()
+            await self._unlease(game_id)
+        self._games.clear()
+
+
+# global instance of GameEngine
+engine = GameEngine(
+    config.game_flush_actions,
+    config.game_flush_interval,
+    config.game_snapshot_every,
+    config.game_lease_ttl
+)
@@ -0,0 +1,118 @@
+from .delta import Delta
+from .models import Game, GameEvent, GameSnapshot
+from .service import GameService
+
+from src.logger import get_logger
+
+from typing import Optional
+from beanie import PydanticObjectId
+from beanie.operators import In
+from pymongo.errors import BulkWriteError
+
+logger = get_logger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def dump(game: Game) -> dict:
+    # snapshot payload, everything but the identity
+    return game.model_dump(exclude={'id', 'revision_id'})
+
+
+def _same(stored: Optional[GameEvent], event: GameEvent) -> bool:
+    return stored is not None and \
+        (stored.type, stored.data, stored.created_at) == \
+        (event.type, event.data, event.created_at)
+
+
+async def append(events: list[GameEvent], overwrite: bool = False) -> bool:
+    # False when a seq is taken by a different event, another writer
+    # got there first. With `overwrite` (the document already holds
+    # these events) whatever else sits under those seqs is replaced
+    if not events:
+        return True
+
+    try:
+        await GameEvent.insert_many(events, ordered=False)
+        return True
+    except BulkWriteError as exc:
+        errors = exc.details.get('writeErrors', [])
+        if any(e.get('code') != DUPLICATE_KEY for e in errors):
+            raise
+
+    # a retried flush writes the very same events again, that's fine
+    taken = [events[e['index']] for e in errors]
+    stored = {
+        e.seq: e async for e in GameEvent.find(
+            GameEvent.game_id == events[0].game_id,
+            In(GameEvent.seq, [e.seq for e in taken])
+        )
+    }
+    conflicts = [e for e in taken if not _same(stored.get(e.seq), e)]
+    if not conflicts:
+        return True
+    if not overwrite:
+        return False
+
+    await GameEvent.find(In(
+        GameEvent.id, [stored[e.seq].id for e in conflicts if e.seq in stored]
+    )).delete()
+    await GameEvent.insert_many(conflicts)
+    return True
+
+
+async def discard(events: list[GameEvent]) -> None:
+    # logged by a flush that then lost the version check, past what
+    # the stored document holds: recover() and replay() must skip them
+    if events:
+        await GameEvent.find(In(GameEvent.id, [e.id for e in events])) \
+            .delete()
+
+
+async def snapshot(game: Game, state: dict, seq: int) -> None:
+    await GameSnapshot(game_id=game.id, seq=seq, state=state).insert()
+
+
+async def recover(game: Game, delta: Delta) -> int:
+    # apply events that were logged but never reached the document,
+    # returns how many were replayed
+    events = await GameEvent.find(
+        GameEvent.game_id == game.id,
+        GameEvent.seq > game.seq
+    ).sort(+GameEvent.seq).to_list()
+
+    for event in events:
+        GameService.apply(game, event, delta)
+
+    if events:
+        logger.warning(f'Recovered {len(events)} events of game {game.id}')
+    return len(events)
+
+
+async def replay(
+    game_id: PydanticObjectId,
+    seq: Optional[int] = None
+) -> Optional[Game]:
+    # rebuild the game as it was right after event number `seq`
+    query = GameSnapshot.find(GameSnapshot.game_id == game_id)
+    if seq is not None:
+        query = query.find(GameSnapshot.seq <= seq)
+
+    snap = await query.sort(-GameSnapshot.seq).first_or_none()
+    if snap is None:
+        return None
+
+    game = Game.model_validate(snap.state)
+    game.id = game_id
+
+    query = GameEvent.find(
+        GameEvent.game_id == game_id,
+        GameEvent.seq > snap.seq
+    )
+    if seq is not None:
+        query = query.find(GameEvent.seq <= seq)
+
+    async for event in query.sort(+GameEvent.seq):
+        GameService.apply(game, event)
+
+    return game
@@ -0,0 +1,231 @@
+import time
+import asyncio
+
+from .models import Game, GameSnapshot
+from .service import GameService
+from . import events
+
+from config import config
+from src.services import cache
+from src.logger import get_logger
+from src.apps.websocket import manager
+
+from typing import Optional
+from beanie import PydanticObjectId
+from pymongo.errors import BulkWriteError
+
+logger = get_logger(__name__)
+
+SIZES = (2, 3, 4)  # same limits as create_game
+
+# KEYS: queue, players  ARGV: player, size, score
+_ENQUEUE = '''
+if redis.call('hexists', KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+redis.call('hset', KEYS[2], ARGV[1], ARGV[2])
+redis.call('zadd', KEYS[1], ARGV[3], ARGV[1])
+return 1
+'''
+
+# KEYS: queue, players  ARGV: player, size
+_CANCEL = '''
+if redis.call('hget', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('hdel', KEYS[2], ARGV[1])
+redis.call('zrem', KEYS[1], ARGV[1])
+return 1
+'''
+
+# KEYS: queue, players  ARGV: size, max groups
+# takes the longest waiting players, whole groups only
+_POP = '''
+local size = tonumber(ARGV[1])
+local groups = math.floor(redis.call('zcard', KEYS[1]) / size)
+local n = math.min(groups, tonumber(ARGV[2])) * size
+if n == 0 then
+    return {}
+end
+local items = redis.call('zrange', KEYS[1], 0, n - 1, 'WITHSCORES')
+redis.call('zremrangebyrank', KEYS[1], 0, n - 1)
+for i = 1, #items, 2 do
+    redis.call('hdel', KEYS[2], items[i])
+end
+return items
+'''
+
+
+def room(player_id: int) -> str:
+    # websocket room a queued player waits in
+    return f'player:{player_id}'
+
+
+class Matchmaker:
+    # players wait in one redis sorted set per game size (score:
+    # time they queued), a hash maps each queued player to its size
+    # so nobody queues twice. The matcher pops whole groups with a
+    # Lua script, so any number of workers can run it side by side,
+    # and creates the games in batches
+
+    def __init__(self, interval: float, batch: int):
+        self.interval = interval
+        self.batch = batch
+        self.prefix = 'mm:'
+
+        self.stats = {'queued': 0, 'matched': 0, 'games': 0}
+
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _keys(self, size: int) -> tuple[str, str]:
+        return f'{self.prefix}queue:{size}', f'{self.prefix}players'
+
+    @property
+    def available(self) -> bool:
+        return cache.redis is not None
+
+    async def enqueue(
+        self,
+        player_id: int,
+        size: int,
+        score: Optional[float] = None
+    ) -> bool:
+        # False if the player is already queued
+        if size not in SIZES:
+            raise ValueError(f'Size must be one of {SIZES}')
+
+        added = await cache.redis.eval(
+            _ENQUEUE, 2, *self._keys(size),
+            player_id, size, score or time.time()
+        )
+        if added:
+            self.stats['queued'] += 1
+            self._wake.set()
+        return bool(added)
+
+    async def cancel(self, player_id: int, size: int) -> bool:
+        # False if the player isn't queued (e.g. already matched)
+        return bool(await cache.redis.eval(
+            _CANCEL, 2, *self._keys(size), player_id, size
+        ))
+
+    async def _pop(self, size: int) -> list[tuple[int, float]]:
+        items = await cache.redis.eval(
+            _POP, 2, *self._keys(size), size, self.batch
+        )
+        return [
+            (int(items[i]), float(items[i + 1]))
+            for i in range(0, len(items), 2)
+        ]
+
+    def start(self) -> None:
+        if self._task is None and self.available:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # cleared before looking, an enqueue() from now on
+            # ends the wait below right away
+            self._wake.clear()
+            try:
+                for size in SIZES:
+                    await self.match(size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f'Matchmaking failed: {exc}')
+
+            # other workers' enqueues are picked up on the next tick
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except TimeoutError:
+                pass
+
+    async def match(self, size: int) -> list[Game]:
+        popped = await self._pop(size)
+        if not popped:
+            return []
+
+        groups = [popped[i:i + size] for i in range(0, len(popped), size)]
+        games = [self._game(size, group) for group in groups]
+
+        stored = await self._insert(games)
+        if len(stored) < len(games):
+            # put the players of the games that are not there back,
+            # with their original place in the queue
+            for game, group in zip(games, groups, strict=True):
+                if game.id not in stored:
+                    for player_id, score in group:
+                        await self.enqueue(player_id, size, score)
+
+            games = [game for game in games if game.id in stored]
+            logger.error(f'Failed to create {len(groups) - len(games)} '
+                         f'matched games, players are queued again')
+            if not games:
+                return []
+
+        try:
+            # replays of the game start from this state
+            await GameSnapshot.insert_many([
+                GameSnapshot(
+                    game_id=game.id, seq=game.seq, state=events.dump(game)
+                )
+                for game in games
+            ])
+        except Exception as exc:
+            # the games exist, their players are matched all the same
+            logger.error(f'Failed to snapshot matched games: {exc}')
+
+        for game in games:
+            message = {
+                'type': 'matched',
+                'game_id': str(game.id),
+                'players': [p.player_id for p in game.players]
+            }
+            for player in game.players:
+                await manager.broadcast(room(player.player_id), message)
+
+        self.stats['matched'] += sum(len(game.players) for game in games)
+        self.stats['games'] += len(games)
+        return games
+
+    @staticmethod
+    async def _insert(games: list[Game]) -> set[PydanticObjectId]:
+        # ids of the games that made it to the db
+        try:
+            await Game.insert_many(games, ordered=False)
+            return {game.id for game in games}
+        except BulkWriteError as exc:
+            failed = {error['index'] for error in exc.details['writeErrors']}
+            return {
+                game.id for i, game in enumerate(games) if i not in failed
+            }
+        except Exception as exc:
+            # unknown how far it got, ask. If that fails too nobody
+            # is queued again, rather than matched twice
+            logger.error(f'Failed to insert matched games: {exc}')
+            cursor = Game.get_motor_collection().find(
+                {'_id': {'$in': [game.id for game in games]}}, {'_id': 1}
+            )
+            return {doc['_id'] async for doc in cursor}
+
+    @staticmethod
+    def _game(size: int, group: list[tuple[int, float]]) -> Game:
+        # a full game, started the same way the last join starts it
+        game = Game(id=PydanticObjectId(), max_players=size)
+        for player_id, _ in group:
+            GameService.add_player(game, player_id)
+        return game
+
+
+matchmaker = Matchmaker(
+    config.matchmaking_interval,
+    config.matchmaking_batch
+)
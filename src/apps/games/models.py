@@ -1,40 +1,200 @@
-from src.model import Model
+from config import config
+from src.model import Model, View
 from src.utils import tmsnow
+from src.board import BOARD, NO_OWNER, Property
+from src.services.cache import cached
 
-from pydantic import Field
-from beanie import Document
-from typing import Optional
+from pymongo import IndexModel, ReturnDocument
+from beanie import Document, PydanticObjectId
 
-
-class Property(Model):
-    id: int
-    name: str
-    price: int
-    rent: list[int]
-    owner_id: Optional[int] = None
+from typing import Any, Optional
+from pydantic import Field, PrivateAttr, model_validator
 
 
 class Player(Model):
     player_id: int
     position: int = 0
     balance: int = 1500
-    properties: list[Property] = Field(default_factory=list)
 
 
 class Game(Document):
     max_players: int
     players: list[Player] = Field(default_factory=list)
-    board: list[Property] = Field(default_factory=list)
+
+    # index of the owning player per board field (NO_OWNER if free),
+    # names, prices and rents come from the shared BOARD template
+    owners: list[int] = Field(
+        default_factory=lambda: [NO_OWNER] * len(BOARD)
+    )
 
     status: str = Field('waiting')  # waiting, active, finished
     current_index: int = 0  # index of the current player
+    version: int = 0  # bumped on every write, see delta.persist
+    seq: int = 0  # number of the last applied GameEvent
 
     started_at: Optional[int] = None
     created_at: int = Field(default_factory=tmsnow)
 
+    # converted from a legacy document, which still has to be
+    # rewritten in the compact form (see delta.persist)
+    _converted: bool = PrivateAttr(False)
+
+    @model_validator(mode='wrap')
+    @classmethod
+    def _legacy_board(cls, data: Any, handler) -> 'Game':
+        # documents stored before the template kept a full board copy
+        converted = isinstance(data, dict) and 'owners' not in data \
+            and 'board' in data
+        if converted:
+            ids = [
+                p['player_id'] if isinstance(p, dict) else p.player_id
+                for p in data.get('players', [])
+            ]
+            data['owners'] = [
+                ids.index(f['owner_id'])
+                if f.get('owner_id') in ids else NO_OWNER
+                for f in data.pop('board')
+            ]
+
+        game = handler(data)
+        if converted:
+            game._converted = True
+        return game
+
+    @property
+    def board(self) -> tuple[Property, ...]:
+        return BOARD
+
+    def player_index(self, player_id: int) -> Optional[int]:
+        return next((
+            i for i, p in enumerate(self.players)
+            if p.player_id == player_id
+        ), None)
+
+    def owner_id(self, position: int) -> Optional[int]:
+        idx = self.owners[position]
+        return None if idx == NO_OWNER else self.players[idx].player_id
+
+    def property_dict(self, position: int) -> dict:
+        return {
+            **BOARD[position].to_dict(),
+            'owner_id': self.owner_id(position)
+        }
+
     def to_dict(self, **kwargs) -> dict:
-        return self.model_dump(mode='json', **kwargs)
+        data = self.model_dump(mode='json', **kwargs)
+        if 'owners' not in data:
+            return data
+
+        # rebuild the public view from the compact state
+        board = [self.property_dict(i) for i in range(len(BOARD))]
+        for idx, player in enumerate(data.get('players', [])):
+            player['properties'] = [
+                board[i] for i, owner in enumerate(self.owners)
+                if owner == idx
+            ]
+
+        data['board'] = board
+        del data['owners']
+        return data
 
     class Settings:
         name = 'games'
+        # load whole documents, legacy ones still carry "board"
+        projection = None
+        indexes = (
+            # lobby: filter, sort and keyset range come from the index
+            IndexModel([('status', 1), ('created_at', -1), ('_id', -1)]),
+            IndexModel([('players.player_id', 1)]),
+        )
+
+
+async def push_player(
+    game_id: PydanticObjectId,
+    player_id: int,
+    joined_at: int
+) -> Optional[dict]:
+    # one conditional update: only a waiting game with a free seat
+    # and without this player matches, the last seat also starts the
+    # game. Returns the raw updated document, None if nothing matched
+    player = Player(player_id=player_id).model_dump()
+    return await Game.get_motor_collection().find_one_and_update(
+        {
+            '_id': game_id,
+            'status': 'waiting',
+            'players.player_id': {'$ne': player_id},
+            '$expr': {'$lt': [{'$size': '$players'}, '$max_players']}
+        },
+        [
+            {'$set': {
+                'players': {'$concatArrays': ['$players', [player]]},
+                'seq': {'$add': [{'$ifNull': ['$seq', 0]}, 1]},
+                'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}
+            }},
+            {'$set': {
+                'status': {'$cond': [
+                    {'$eq': [{'$size': '$players'}, '$max_players']},
+                    'active', '$status'
+                ]},
+                'started_at': {'$cond': [
+                    {'$eq': [{'$size': '$players'}, '$max_players']},
+                    joined_at, '$started_at'
+                ]}
+            }}
+        ],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+class PlayerId(View):
+    player_id: int
 
+
+class LobbyGame(View):
+    # lobby row, only these fields are read from MongoDB
+    id: PydanticObjectId = Field(alias='_id')
+    max_players: int
+    players: list[PlayerId]
+    created_at: int
+
+
+class GameSeats(View):
+    # what a join needs to know about a game
+    status: str
+    max_players: int
+    players: list[PlayerId]
+
+
+@cached('games:waiting:count', ttl=config.lobby_count_ttl)
+async def count_waiting() -> int:
+    # served from the (status, ...) index, cached since the lobby
+    # is polled all the time and the number is only informative
+    return await Game.find(Game.status == 'waiting').count()
+
+
+class GameEvent(Document):
+    # append-only log entry, enough to replay one action
+    game_id: PydanticObjectId
+    seq: int
+    type: str  # join, roll, buy
+    data: list[int]
+    created_at: int = Field(default_factory=tmsnow)
+
+    class Settings:
+        name = 'game_events'
+        indexes = (
+            IndexModel([('game_id', 1), ('seq', 1)], unique=True),
+        )
+
+
+class GameSnapshot(Document):
+    # full state of a game right after event number `seq`
+    game_id: PydanticObjectId
+    seq: int
+    state: dict[str, Any]
+
+    class Settings:
+        name = 'game_snapshots'
+        indexes = (
+            IndexModel([('game_id', 1), ('seq', -1)], unique=True),
+        )
@@ -1,15 +1,28 @@
-from .models import \
-    Game, Property, Player
+import jwt
+
+from .models import Game, GameEvent, GameSeats, Player, LobbyGame, \
+    count_waiting, push_player
+
+from .service import GameService
+from . import events
+from .engine import LiveGame, RoomOwnedError, engine
+from .matchmaking import SIZES, matchmaker, room
 
 from src.utils import tmsnow
-from src.game import GameService
+from src.encoder import loads
 from src.apps.websocket import manager
 
+from src.apps.security import verify
 from src.apps.depends import get_user_id
+from src.apps.pagination import CursorPaginated, \
+    decode_cursor, encode_cursor
 
-from typing import Any
+from functools import partial
+from bson.errors import InvalidId
+from beanie import PydanticObjectId
+from typing import Any, Optional
 from fastapi import APIRouter, \
-    Depends, WebSocket, HTTPException
+    Depends, Query, WebSocket, HTTPException
 
 router = APIRouter(prefix='/games', tags=['games'])
 
@@ -25,24 +38,15 @@ async def create_game(
     if max_players < 2 or max_players > 4:
         raise HTTPException(400, 'Max players must be between 2 and 4')
 
-    board = [
-        Property(
-            id=i,
-            name=f'Field {i}',
-            price=100 + i*10,
-            rent=[10, 20, 30]
-        )
-        for i in range(40)
-    ]
-
     game = Game(
         max_players=max_players,
-        board=board,
         players=[Player(
             player_id=player_id
         )]
     )
     await game.insert()
+    # replays of the game start from this state
+    await events.snapshot(game, events.dump(game), game.seq)
 
     return {
         'game_id': str(game.id),
@@ -51,26 +55,59 @@ async def create_game(
     }
 
 
-@router.post(
-    path='/{game_id}/join',
-    response_model=dict[str, Any]
+@router.get(
+    path='/lobby',
+    response_model=CursorPaginated[LobbyGame]
 )
-async def join_game(game_id: str, player_id: int):
-    game = await Game.get(game_id)
-    if not game:
-        raise HTTPException(404, 'Game not found')
+async def lobby(
+    cursor: Optional[str] = None,
+    size: int = Query(20, ge=1, le=50),
+    count: bool = False
+):
+    # waiting games, newest first
+    query: dict[str, Any] = {'status': 'waiting'}
+    if cursor:
+        try:
+            created_at, game_id = decode_cursor(cursor)
+            created_at = int(created_at)
+            game_id = PydanticObjectId(game_id)
+        except (ValueError, InvalidId):
+            raise HTTPException(400, 'Invalid cursor')
 
-    if any(p.player_id == player_id for p in game.players):
+        # strictly after the last item of the previous page
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': game_id}}
+        ]
+
+    games = await LobbyGame.find(
+        Game, query,
+        sort=[('created_at', -1), ('_id', -1)],
+        limit=size + 1
+    )
+
+    next_cursor = None
+    if len(games) > size:
+        games = games[:size]
+        next_cursor = encode_cursor(games[-1].created_at, games[-1].id)
+
+    return {
+        'items': games,
+        'next_cursor': next_cursor,
+        'total': await count_waiting() if count else None
+    }
+
+
+def _join(live: LiveGame, player_id: int) -> dict[str, Any]:
+    # runs inside the game actor
+    game = live.game
+    if game.player_index(player_id) is not None:
         raise HTTPException(400, 'Player already joined')
     if len(game.players) >= game.max_players:
         raise HTTPException(400, 'Game is full')
 
-    game.players.append(Player(player_id=player_id))
-    if len(game.players) == game.max_players:
-        game.status = 'active'
-        game.started_at = tmsnow()
-
-    await game.save()
+    GameService.add_player(game, player_id, live.delta)
+    live.record('join', [player_id])
 
     return {
         'status': game.status,
@@ -78,73 +115,236 @@ async def join_game(game_id: str, player_id: int):
     }
 
 
+@router.post(
+    path='/{game_id}/join',
+    response_model=dict[str, Any]
+)
+async def join_game(game_id: PydanticObjectId, player_id: int):
+    if engine.get(str(game_id)) is not None:
+        # the room is live here: its actor owns the state, a write
+        # around it would race the actions it hasn't flushed yet
+        live = None
+        try:
+            live = await engine.acquire(str(game_id))
+            result = await engine.submit(
+                live, partial(_join, player_id=player_id)
+            )
+            # joins are rare, persist them right away
+            if not await engine.flush(live):
+                if live.game.player_index(player_id) is None:
+                    # a version conflict dropped it with the room's state
+                    raise HTTPException(409, 'Game has changed, try again')
+                # still applied, the room retries the write later
+                raise HTTPException(503, 'Game could not be saved')
+        except RoomOwnedError:  # taken over in the meantime
+            raise HTTPException(503, 'Game is live on another worker')
+        finally:
+            if live is not None:
+                await engine.release(str(game_id))
+        return result
+
+    if await engine.owned_elsewhere(str(game_id)):
+        # its actor would lose this write or overwrite it,
+        # requests of a live room belong to the owning worker
+        raise HTTPException(503, 'Game is live on another worker')
+
+    # nobody holds the state in memory: a single conditional update,
+    # concurrent joins (from any worker) can't overfill the game
+    joined_at = tmsnow()
+    doc = await push_player(game_id, player_id, joined_at)
+
+    if doc is None:
+        # only failed joins pay for a read, to tell the reason
+        seats = await GameSeats.find_one(Game, {'_id': game_id})
+        if seats is None:
+            raise HTTPException(404, 'Game not found')
+        if any(p.player_id == player_id for p in seats.players):
+            raise HTTPException(400, 'Player already joined')
+        if len(seats.players) >= seats.max_players:
+            raise HTTPException(400, 'Game is full')
+        raise HTTPException(400, f'Game is {seats.status}')
+
+    # the log entry replay needs, joined_at doubles as started_at.
+    # The document says this seq is the join, so it wins over any
+    # orphan of a room that lost a version check
+    await events.append([GameEvent(
+        game_id=game_id,
+        seq=doc['seq'],
+        type='join',
+        data=[player_id],
+        created_at=joined_at
+    )], overwrite=True)
+
+    await engine.adopt(str(game_id), doc)
+
+    return {
+        'status': doc['status'],
+        'players': [p['player_id'] for p in doc['players']]
+    }
+
+
+@router.get(
+    path='/{game_id}/replay',
+    response_model=dict[str, Any]
+)
+async def replay_game(
+    game_id: PydanticObjectId,
+    seq: Optional[int] = None,
+    _: int = Depends(get_user_id)
+):
+    # state of the game right after event number `seq` (latest if unset)
+    game = await events.replay(game_id, seq)
+    if not game:
+        raise HTTPException(404, 'Game history not found')
+
+    return game.to_dict()
+
+
+def _play(
+    live: LiveGame,
+    action: str,
+    pid: int
+) -> Optional[tuple[bool, dict[str, Any]]]:
+    # runs inside the game actor, returns (to whole room, message)
+    game = live.game
+
+    idx = game.player_index(pid)
+    if idx is None:
+        return False, {'detail': 'Player not in game'}
+
+    if action == 'roll':
+        d1, d2 = GameService.roll_dice()
+        steps = d1 + d2
+
+        # move player by steps
+        GameService.move_player(game, idx, steps, live.delta)
+        live.record('roll', [idx, d1, d2])
+
+        return True, {
+            'type': 'rolled',
+            'player_id': pid,
+            'dice': [d1, d2],
+            'position': game.players[idx].position,
+            'balance': game.players[idx].balance
+        }
+
+    elif action == 'prompt_buy':
+        # check if player can buy property
+        position = game.players[idx].position
+        prop = game.board[position]
+
+        can_buy = (
+            game.owner_id(position) is None and
+            game.players[idx].balance >= prop.price
+        )
+
+        return False, {
+            'type': 'can_buy',
+            'can_buy': can_buy,
+            'property': game.property_dict(position)
+        }
+
+    elif action == 'buy':
+        success = GameService.purchase_property(game, idx, live.delta)
+        if success:
+            live.record('buy', [idx])
+
+        return True, {
+            'type': 'bought',
+            'player_id': pid,
+            'success': success,
+            'property_id': game.board[game.players[idx].position].id,
+            'balance': game.players[idx].balance
+        }
+
+    return None
+
+
+@router.websocket(
+    path='/ws/matchmaking'
+)
+async def matchmaking_ws(ws: WebSocket, token: str, max_players: int = 4):
+    # queued while connected, gets {'type': 'matched', 'game_id': ...}
+    # and then plays at /games/ws/{game_id}
+    try:
+        player_id = int(verify(token)['user_id'])
+    except (jwt.PyJWTError, KeyError, ValueError):
+        await ws.close(1008)
+        return
+
+    if max_players not in SIZES:
+        await ws.close(1008)
+        return
+
+    if not matchmaker.available:
+        await ws.close(1013)  # needs redis
+        return
+
+    # join the room first, so the match can't be missed
+    player_room = room(player_id)
+    await manager.connect(player_room, ws)
+    queued = False
+
+    try:
+        queued = await matchmaker.enqueue(player_id, max_players)
+        if not queued:
+            await manager.send(ws, {'detail': 'Already queued'})
+            return
+
+        # may arrive after 'matched' when the match is instant
+        await manager.send(ws, {'type': 'queued', 'max_players': max_players})
+        while True:
+            await ws.receive_text()  # just wait for the client to leave
+
+    except Exception:
+        pass
+    finally:
+        if queued:
+            # no-op if matched in the meantime
+            await matchmaker.cancel(player_id, max_players)
+        await manager.disconnect(player_room, ws)
+
+
 @router.websocket(
     path='/ws/{game_id}'
 )
-async def game_ws(ws: WebSocket, game_id: str):
+async def game_ws(ws: WebSocket, game_id: PydanticObjectId):
+    # a malformed id is refused before anything is set up
+    game_id = str(game_id)
     await manager.connect(game_id, ws)
+    live = None
 
     try:
-        game = await Game.get(game_id)
-        await ws.send_json({'type': 'init', 'game': game.to_dict()})
+        live = await engine.acquire(game_id)
+        if live is None:
+            await manager.send(ws, {'detail': 'Game not found'})
+            return
+
+        init = await engine.submit(live, lambda live: live.game.to_dict())
+        await manager.send(ws, {'type': 'init', 'game': init})
 
         while True:
-            data = await ws.receive_json()
+            data = loads(await ws.receive_text())
             action: str = data.get('action')
-            pid: str = data.get('player_id')
-
-            idx = next((
-                i for i, p in enumerate(game.players)
-                if p.player_id == pid
-            ), None)
+            pid: int = data.get('player_id')
 
-            if idx is None:
-                await ws.send_json({'detail': 'Player not in game'})
+            result = await engine.submit(
+                live, partial(_play, action=action, pid=pid)
+            )
+            if result is None:
                 continue
 
-            if action == 'roll':
-                d1, d2 = GameService.roll_dice()
-                steps = d1 + d2
-
-                # move player by steps
-                GameService.move_player(game, idx, steps)
-
-                await manager.broadcast(game_id, {
-                    'type': 'rolled',
-                    'player_id': pid,
-                    'dice': [d1, d2],
-                    'position': game.players[idx].position,
-                    'balance': game.players[idx].balance
-                })
-
-            elif action == 'prompt_buy':
-                # check if player can buy property
-                prop = game.board[game.players[idx].position]
-
-                can_buy = (
-                    prop.owner_id is None and
-                    game.players[idx].balance >= prop.price
-                )
-
-                await ws.send_json({
-                    'type': 'can_buy',
-                    'can_buy': can_buy,
-                    'property': prop.to_dict()
-                })
-
-            elif action == 'buy':
-                success = GameService.purchase_property(game, idx)
-                await manager.broadcast(game_id, {
-                    'type': 'bought',
-                    'player_id': pid,
-                    'success': success,
-                    'property_id': game.board[game.players[idx].position].id,
-                    'balance': game.players[idx].balance
-                })
-
-            await game.save()
+            to_room, message = result
+            if to_room:
+                await manager.broadcast(game_id, message)
+            else:
+                await manager.send(ws, message)
 
+    except RoomOwnedError:
+        await manager.send(ws, {'detail': 'Game is live on another worker'})
     except Exception:
         pass
     finally:
-        manager.disconnect(game_id, ws)
+        await manager.disconnect(game_id, ws)
+        if live is not None:
+            await engine.release(game_id)
@@ -0,0 +1,100 @@
+import random
+
+from .delta import Delta
+from .models import Game, GameEvent, Player
+
+from src.utils import tmsnow
+from src.board import NO_OWNER
+
+from typing import Optional
+
+
+class GameService:
+    @staticmethod
+    def roll_dice() -> tuple[int, int]:
+        return random.randint(1, 6), random.randint(1, 6)
+
+    @staticmethod
+    def add_player(
+        game: Game,
+        player_id: int,
+        delta: Optional[Delta] = None,
+        started_at: Optional[int] = None
+    ) -> None:
+        player = Player(player_id=player_id)
+        game.players.append(player)
+
+        if delta is not None:
+            delta.push('players', player.to_dict())
+
+        if len(game.players) == game.max_players:
+            game.status = 'active'
+            game.started_at = started_at or tmsnow()
+
+            if delta is not None:
+                delta.set('status', game.status)
+                delta.set('started_at', game.started_at)
+
+    @staticmethod
+    def move_player(
+        game: Game,
+        player_idx: int,
+        steps: int,
+        delta: Optional[Delta] = None
+    ) -> None:
+        ps = game.players[player_idx]
+        prev = ps.position
+
+        ps.position = (prev + steps) % len(game.board)
+        # bunus for passing "START" (e.g., collecting $200)
+        passed = prev + steps >= len(game.board)
+        if passed:
+            ps.balance += 200
+
+        if delta is not None:
+            delta.set(f'players.{player_idx}.position', ps.position)
+            if passed:
+                delta.set(f'players.{player_idx}.balance', ps.balance)
+
+    @staticmethod
+    def purchase_property(
+        game: Game,
+        player_idx: int,
+        delta: Optional[Delta] = None
+    ) -> bool:
+        ps = game.players[player_idx]
+        prop = game.board[ps.position]
+
+        if game.owners[ps.position] == NO_OWNER \
+                and ps.balance >= prop.price:
+            ps.balance -= prop.price
+            game.owners[ps.position] = player_idx
+
+            if delta is not None:
+                delta.set(f'players.{player_idx}.balance', ps.balance)
+                delta.set(f'owners.{ps.position}', player_idx)
+            return True
+
+        return False
+
+    @staticmethod
+    def apply(
+        game: Game,
+        event: GameEvent,
+        delta: Optional[Delta] = None
+    ) -> None:
+        # replay one logged event onto the state
+        match event.type:
+            case 'join':
+                GameService.add_player(
+                    game, event.data[0], delta, event.created_at
+                )
+            case 'roll':
+                idx, d1, d2 = event.data
+                GameService.move_player(game, idx, d1 + d2, delta)
+            case 'buy':
+                GameService.purchase_property(game, event.data[0], delta)
+
+        game.seq = event.seq
+        if delta is not None:
+            delta.set('seq', game.seq)
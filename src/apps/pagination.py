@@ -1,8 +1,15 @@
+import base64
+
 from src.model import Model
 from pydantic import ConfigDict
-from typing import Generic, TypeVar
+from typing import Generic, Optional, TypeVar
 
-__all__ = ('Paginated',)
+__all__ = (
+    'CursorPaginated',
+    'Paginated',
+    'decode_cursor',
+    'encode_cursor'
+)
 
 T = TypeVar('T')
 
@@ -15,3 +22,24 @@ class Paginated(Model, Generic[T]):
     items: list[T]
 
     model_config = ConfigDict(extra='ignore')
+
+
+class CursorPaginated(Model, Generic[T]):
+    # keyset pagination, pass `next_cursor` back for the next page
+    items: list[T]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None  # estimate, only when asked for
+
+    model_config = ConfigDict(extra='ignore')
+
+
+def encode_cursor(*values: int | str) -> str:
+    # opaque to clients: the sort key of the last item on a page
+    raw = ':'.join(map(str, values)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list[str]:
+    # raises ValueError for anything encode_cursor didn't produce
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return base64.urlsafe_b64decode(padded).decode().split(':')
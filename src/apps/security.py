@@ -1,10 +1,67 @@
 import jwt
+import time
+import hashlib
 
 from config import config
+from typing import Optional
+from collections import OrderedDict
 
 ALGORITHM = 'HS256'
 
 
+class TokenCache:
+    # bounded LRU of verified payloads, keyed by the token digest;
+    # entries live until `ttl` or the token's own `exp`
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._secret = config.jwt_secret
+        self._items: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        if self._secret != config.jwt_secret:
+            # secret rotated, nothing cached is trustworthy anymore
+            self.clear()
+            self._secret = config.jwt_secret
+
+        key = self._key(token)
+        item = self._items.get(key)
+
+        if item is None or item[0] <= time.time():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, token: str, payload: dict) -> None:
+        expires = time.time() + self.ttl
+        if 'exp' in payload:
+            expires = min(expires, payload['exp'])
+
+        self._items[self._key(token)] = (expires, payload)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+token_cache = TokenCache(config.token_cache_size, config.token_cache_ttl)
+
+
 def encode(payload: dict) -> str:
     return jwt.encode(payload, config.jwt_secret, algorithm=ALGORITHM)
 
@@ -13,6 +70,16 @@ def decode(token: str) -> dict:
     return jwt.decode(token, config.jwt_secret, algorithms=[ALGORITHM])
 
 
+def verify(token: str) -> dict:
+    # decode() that skips the HMAC check for recently seen tokens
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = decode(token)
+        token_cache.set(token, payload)
+
+    return dict(payload)
+
+
 def create_token(user_id: int, purpose: str = 'auth') -> str:
     payload = {'user_id': user_id, 'purpose': purpose}
     return encode(payload)
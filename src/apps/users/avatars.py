@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+
+from pathlib import Path
+
+from .models import User, update_user
+
+from config import config
+from src.utils import tmsnow
+from src.logger import get_logger
+from src.services.cache import init_redis
+from src.services.images import ImageError, images
+from src.services.s3client import UploadTooLargeError, s3
+
+from typing import Optional
+from pydantic import Field
+from beanie import Document, init_beanie
+from pymongo import IndexModel, ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = get_logger(__name__)
+
+PENDING, FAILED = 'pending', 'failed'
+
+AVATAR_MAX_SIZE = 3 * 1024 * 1024  # 3MB in bytes
+
+
+class AvatarJob(Document):
+    # a raw upload in the bucket waiting for its WebP variants,
+    # one per user, a newer upload replaces it. Removed when done
+    id: int  # user id
+    filename: str
+
+    status: str = PENDING  # pending, failed
+    attempts: int = 0
+    available_at: int = Field(default_factory=tmsnow)
+    last_error: Optional[str] = None
+
+    created_at: int = Field(default_factory=tmsnow)
+
+    class Settings:
+        name = 'avatar_jobs'
+        indexes = (
+            IndexModel([('status', 1), ('available_at', 1)]),
+        )
+
+
+def variant_names(user_id: str, sizes: tuple[int, ...]) -> dict[int, str]:
+    hashed_name = hashlib.md5(user_id.encode()).hexdigest()
+    return {size: f'{hashed_name}_{size}.webp' for size in sizes}
+
+
+async def _drop_old_avatars(user_id: str, keep: set[str]) -> None:
+    # drop previous avatars and raw uploads
+    try:
+        keys = await s3.list_objects(
+            object_id=user_id, category='avatars'
+        )
+        await s3.delete_objects([
+            key for key in keys if Path(key).name not in keep
+        ])
+    except Exception as exc:
+        # log but don't block upload
+        logger.error(f'Failed to clean up avatars of {user_id}: {exc}')
+
+
+async def store_variants(user_id: str, data: bytes) -> dict[int, str]:
+    # resized WebP variants replace whatever was uploaded,
+    # the original (and its metadata) is never published.
+    # Raises ImageError for broken input, LookupError without a user
+    variants = await images.variants(data)
+    names = variant_names(user_id, tuple(variants))
+
+    # runs alongside the upload
+    cleaning = asyncio.create_task(
+        _drop_old_avatars(user_id, set(names.values()))
+    )
+    try:
+        await asyncio.gather(*(
+            s3.upload(
+                bytes=variants[size],
+                filename=names[size],
+                object_id=user_id,
+                content_type='image/webp',
+                category='avatars'
+            )
+            for size in variants
+        ))
+    finally:
+        await cleaning
+
+    # save the largest variant as the avatar key in db,
+    # the only field that changes, so the user isn't loaded
+    if not await update_user(int(user_id), avatar=names[max(names)]):
+        raise LookupError(f'User {user_id} not found')
+    return names
+
+
+class AvatarWorker:
+    # turns presigned uploads into avatar variants outside the
+    # request path, so the upload bytes never pass the API workers.
+    # A claimed job is hidden for `lease` seconds, a crash mid-way
+    # leaves it to be picked up again
+
+    def __init__(
+        self,
+        poll_interval: float,
+        lease: int,
+        max_attempts: int
+    ):
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self.stats = {'done': 0, 'retried': 0, 'failed': 0}
+        self._task: Optional[asyncio.Task] = None
+
+    async def enqueue(self, user_id: int, filename: str) -> None:
+        # replaces the user's job: a newer upload starts over
+        await AvatarJob(id=user_id, filename=filename).save()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _claim(self) -> Optional[AvatarJob]:
+        now = tmsnow()
+        doc = await AvatarJob.get_motor_collection().find_one_and_update(
+            {'status': PENDING, 'available_at': {'$lte': now}},
+            {
+                '$set': {'available_at': now + self.lease},
+                '$inc': {'attempts': 1}
+            },
+            sort=[('available_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return None if doc is None else AvatarJob.model_validate(doc)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+                if job is not None:
+                    await self._process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f'Avatar worker failed: {exc}')
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def _process(self, job: AvatarJob) -> None:
+        user_id = str(job.id)
+        try:
+            data = await s3.download(
+                filename=job.filename,
+                object_id=user_id,
+                category='avatars',
+                max_size=AVATAR_MAX_SIZE
+            )
+            if data is None:
+                raise ImageError('Avatar not uploaded')
+            await store_variants(user_id, data)
+        except (ImageError, UploadTooLargeError, LookupError) as exc:
+            # retrying won't change the file
+            await self._finish(job, FAILED, str(exc))
+            self.stats['failed'] += 1
+            return
+        except Exception as exc:
+            logger.error(f'Failed to process avatar of {user_id}: {exc}')
+            if job.attempts >= self.max_attempts:
+                await self._finish(job, FAILED, str(exc))
+                self.stats['failed'] += 1
+            else:
+                self.stats['retried'] += 1  # once the lease runs out
+            return
+
+        # unless the user uploaded again in the meantime
+        await AvatarJob.get_motor_collection().delete_one(
+            {'_id': job.id, 'created_at': job.created_at}
+        )
+        self.stats['done'] += 1
+
+    @staticmethod
+    async def _finish(job: AvatarJob, status: str, error: str) -> None:
+        await AvatarJob.get_motor_collection().update_one(
+            {'_id': job.id, 'created_at': job.created_at},
+            {'$set': {'status': status, 'last_error': error[:500]}}
+        )
+
+
+avatars = AvatarWorker(
+    config.avatar_poll_interval,
+    config.avatar_lease,
+    config.avatar_max_attempts
+)
+
+
+async def _main() -> None:
+    # standalone worker process, next to the API workers
+    client = AsyncIOMotorClient(config.mongo_uri)
+    await init_beanie(
+        database=client.monopoly,
+        document_models=[User, AvatarJob],
+        skip_indexes=True  # the API workers create them
+    )
+    if config.redis_uri:
+        await init_redis(config.redis_uri)  # drops cached users
+
+    images.start()
+    await s3.start()
+    avatars.start()
+    logger.info('Avatar worker started')
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await avatars.close()
+        await s3.close()
+        images.close()
+        client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
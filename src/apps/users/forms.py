@@ -11,3 +11,7 @@ class UserCreate(Model):
 class UserLogin(Model):
     email: EmailStr
     password: str
+
+
+class AvatarUpload(Model):
+    filename: str
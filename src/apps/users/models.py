@@ -1,8 +1,11 @@
-from src.model import Model
+from src.model import Model, View
 from src.utils import tmsnow
+from src.services.cache import cache, cached
 
-from beanie import Document
-from typing import Optional
+from typing import Any, Optional
+from pymongo import IndexModel
+from beanie import Document, Delete, Replace, \
+    Save, SaveChanges, Update, after_event
 
 from pydantic import \
     Field, EmailStr, ConfigDict
@@ -42,5 +45,53 @@ class User(Document):
     def set_last_login(self) -> None:
         self.last_login = tmsnow()
 
+    @after_event(Save, Replace, SaveChanges, Update, Delete)
+    async def _invalidate(self) -> None:
+        await cache.delete(f'user:{self.id}')
+
     class Settings:
         name = 'users'
+        indexes = (
+            # login lookups, and it closes the double registration race
+            IndexModel([('email', 1)], unique=True),
+        )
+
+
+class UserId(View):
+    # existence checks
+    id: int = Field(alias='_id')
+
+
+class UserProfile(View):
+    # everything but the password hash, what get_user caches. A read
+    # model: there is nothing to save back over the stored user
+    id: int = Field(alias='_id')
+    name: str
+    email: EmailStr
+    avatar: Optional[str] = None
+    stats: Stats = Field(default_factory=Stats)
+
+    is_admin: bool = False
+    is_active: bool = True
+    is_verified: bool = False
+
+    last_login: Optional[int] = None
+    created_at: Optional[int] = None
+
+    model_config = ConfigDict(populate_by_name=True)
+
+
+@cached('user:{0}', model=UserProfile)
+async def get_user(user_id: int) -> Optional[UserProfile]:
+    return await UserProfile.find_one(User, {'_id': user_id})
+
+
+async def update_user(user_id: int, **fields: Any) -> bool:
+    # one $set, without loading, validating and re-saving the whole
+    # document. No Save event fires here, so the cache is dropped by
+    # hand. False if there is no such user
+    result = await User.get_motor_collection().update_one(
+        {'_id': user_id}, {'$set': fields}
+    )
+    await cache.delete(f'user:{user_id}')
+    return result.matched_count == 1
@@ -1,8 +1,8 @@
-from .models import User
+from .models import UserProfile
 from src.model import Model
 
 
-class UserPublic(User):
+class UserPublic(UserProfile):
     pass
 
 
@@ -4,23 +4,73 @@ import hashlib
 import mimetypes
 from pathlib import Path
 
-from .models import User
-from .forms import UserCreate, UserLogin
+from .models import User, UserId, get_user, update_user
+from .avatars import AVATAR_MAX_SIZE, FAILED, AvatarJob, avatars, \
+    store_variants
+from .forms import UserCreate, UserLogin, AvatarUpload
 from .public import UserPublic, AuthResponse
 
+from src.logger import get_logger
 from src.services.s3client import s3
-from src.services.snowflake import Snowflake
-from config import ALLOWED_DOMAINS, ALLOWED_FILE_EXTS
+from src.services.images import ImageBusyError, ImageError
+from src.services.snowflake import snowflake
+from src.services.passwords import HasherBusyError, hasher
+from config import config, ALLOWED_DOMAINS, ALLOWED_FILE_EXTS
 
 from src.apps.depends import login_required
 from src.apps.security import create_token, decode
 from src.services.email import email_exists, send_verification_email
 
+from pymongo.errors import DuplicateKeyError
 from fastapi import APIRouter, Request, \
     UploadFile, Depends, HTTPException
 
+logger = get_logger(__name__)
+
 router = APIRouter(prefix='/users', tags=['users'])
 
+CDN_URL = 'https://cdn.monopoliya.fun'
+
+
+def _avatar_filename(user_id: str, filename: str) -> str:
+    ext = Path(filename).suffix.lower()
+    if ext not in ALLOWED_FILE_EXTS:
+        raise HTTPException(400, f'Invalid file extension: {ext}')
+
+    hashed_name = hashlib.md5(user_id.encode()).hexdigest()
+    return f'{hashed_name}{ext}'
+
+
+async def _read_avatar(upl: UploadFile) -> bytes:
+    # the size limit is enforced while reading, not trusted from headers
+    data = bytearray()
+    while chunk := await upl.read(64 * 1024):
+        data += chunk
+        if len(data) > AVATAR_MAX_SIZE:
+            raise HTTPException(400, 'File size exceeds limit of 3MB')
+
+    if not data:
+        raise HTTPException(400, 'File is empty')
+    return bytes(data)
+
+
+async def _store_avatar(user_id: str, data: bytes) -> dict:
+    try:
+        names = await store_variants(user_id, data)
+    except ImageError as exc:
+        raise HTTPException(400, str(exc))
+    except ImageBusyError:
+        raise HTTPException(503, 'Server is busy, try again later')
+    except LookupError:
+        raise HTTPException(404, 'User not found')
+
+    # construct URLs dynamically
+    urls = {
+        str(size): f'{CDN_URL}/avatars/{user_id}/{name}'
+        for size, name in sorted(names.items())
+    }
+    return {'url': urls[str(max(names))], 'variants': urls}
+
 
 @router.post(
     path='/register',
@@ -31,7 +81,7 @@ async def register(user: UserCreate):
     if domain not in ALLOWED_DOMAINS:
         raise HTTPException(400, 'Email domain not allowed')
 
-    existing = await User.find_one(User.email == user.email)
+    existing = await UserId.find_one(User, {'email': user.email})
     if existing:
         raise HTTPException(400, 'User already exists')
 
@@ -40,10 +90,13 @@ async def register(user: UserCreate):
 
     # generate a unique user ID
     # using Snowflake ID generator
-    user_id = Snowflake.generate()
+    user_id = snowflake.generate()
 
     # hash the password for security
-    hashed = hashlib.md5(user.password.encode()).hexdigest()
+    try:
+        hashed = await hasher.hash(user.password)
+    except HasherBusyError:
+        raise HTTPException(503, 'Server is busy, try again later')
 
     new_user = User(
         id=user_id,
@@ -53,8 +106,12 @@ async def register(user: UserCreate):
     )
 
     new_user.set_last_login()
-    # adding new user to db
-    await new_user.insert()
+    # adding new user to db, the unique email index
+    # catches a concurrent registration of the same address
+    try:
+        await new_user.insert()
+    except DuplicateKeyError:
+        raise HTTPException(400, 'User already exists')
 
     verify_token = create_token(new_user.id, 'verify')
     # Here you would send the verification email with the token
@@ -73,15 +130,27 @@ async def login(credentials: UserLogin):
     if not user:
         raise HTTPException(401, 'Invalid credentials')
 
-    hashed = hashlib.md5(credentials.password.encode()).hexdigest()
-    if hashed != user.password:
+    try:
+        valid = await hasher.verify(credentials.password, user.password)
+        rehash = valid and hasher.needs_rehash(user.password)
+        if rehash:
+            # upgrade legacy md5 / outdated cost on the way in
+            user.password = await hasher.hash(credentials.password)
+    except HasherBusyError:
+        raise HTTPException(503, 'Server is busy, try again later')
+
+    if not valid:
         raise HTTPException(401, 'Invalid credentials')
 
     if not user.is_verified:
         raise HTTPException(403, 'Email not verified')
 
     user.set_last_login()
-    await user.save()
+    # only the changed fields, not a full save of the document
+    changes = {'last_login': user.last_login}
+    if rehash:
+        changes['password'] = user.password
+    await update_user(user.id, **changes)
 
     token = create_token(user.id)
     return {'token': token, 'user': user}
@@ -92,7 +161,7 @@ async def login(credentials: UserLogin):
     response_model=UserPublic
 )
 async def get_me(payload: dict = Depends(login_required)):
-    user = await User.find_one(User.id == payload['user_id'])
+    user = await get_user(payload['user_id'])
     if not user:
         raise HTTPException(404, 'User not found')
     return user
@@ -110,13 +179,9 @@ async def verify_email(token: str):
     if data.get('purpose') != 'verify':
         raise HTTPException(400, 'Invalid token')
 
-    user = await User.get(data['user_id'])
-    if not user:
+    if not await update_user(data['user_id'], is_verified=True):
         raise HTTPException(404, 'User not found')
 
-    user.is_verified = True
-    await user.save()
-
     return {'detail': 'Email verified successfully'}
 
 
@@ -129,59 +194,75 @@ async def update_avatar(
     upl: UploadFile,
     payload: dict = Depends(login_required)
 ):
-    max_size = 3 * 1024 * 1024  # 3MB in bytes
-    if upl.size and upl.size > max_size:
+    if upl.size and upl.size > AVATAR_MAX_SIZE:
         raise HTTPException(400, 'File size exceeds limit of 3MB')
 
-    ext = Path(upl.filename).suffix.lower()
-    if ext not in ALLOWED_FILE_EXTS:
-        raise HTTPException(400, f'Invalid file extension: {ext}')
+    user_id = str(payload['user_id'])
+    _avatar_filename(user_id, upl.filename)  # validates the extension
 
-    file_bytes = await upl.read()
-    content_type, _ = mimetypes.guess_type(upl.filename)
+    data = await _read_avatar(upl)
+    return await _store_avatar(user_id, data)
 
-    user_id = str(payload['user_id'])
-    hashed_name = hashlib.md5(user_id.encode()).hexdigest()
 
-    hashed_filename = f'{hashed_name}{ext}'
+@router.post(
+    path='/avatar/upload',
+    response_model=dict
+)
+async def avatar_upload(
+    form: AvatarUpload,
+    payload: dict = Depends(login_required)
+):
+    # presigned POST, the client uploads straight to the bucket
+    # and then calls /avatar/finalize
+    user_id = str(payload['user_id'])
+    filename = _avatar_filename(user_id, form.filename)
+    content_type, _ = mimetypes.guess_type(filename)
 
-    try:
-        keys = await s3.list_objects(
-            object_id=user_id, category='avatars'
-        )
-
-        for key in keys:
-            old_file = Path(key).name
-            # skip if the file is the same
-            if old_file != hashed_filename:
-                await s3.delete_object(
-                    object_id=user_id,
-                    filename=old_file,
-                    category='avatars'
-                )
-
-    except Exception:
-        # Log but don't block upload
-        pass
-
-    await s3.upload(
-        bytes=file_bytes,
-        filename=hashed_filename,
+    post = await s3.presigned_post(
+        filename=filename,
         object_id=user_id,
         content_type=content_type,
-        category='avatars'
+        max_size=AVATAR_MAX_SIZE,
+        category='avatars',
+        expires=config.aws_presign_expires
     )
+    return {'url': post['url'], 'fields': post['fields']}
 
-    user = await User.get(user_id)
-    if not user:
-        raise HTTPException(404, 'User not found')
 
-    # save avatar key in db
-    user.avatar = hashed_filename
-    await user.save()
+@router.post(
+    path='/avatar/finalize',
+    response_model=dict,
+    status_code=202
+)
+async def avatar_finalize(
+    form: AvatarUpload,
+    payload: dict = Depends(login_required)
+):
+    # only checks the upload is there, the variants are made by the
+    # avatar worker, see /avatar/status
+    user_id = str(payload['user_id'])
+    filename = _avatar_filename(user_id, form.filename)
+
+    if not await s3.exists(
+        filename=filename,
+        object_id=user_id,
+        category='avatars'
+    ):
+        raise HTTPException(400, 'Avatar not uploaded')
+
+    await avatars.enqueue(payload['user_id'], filename)
+    return {'detail': 'Avatar is being processed'}
 
-    # construct URL dynamically
-    base_url = 'https://cdn.monopoliya.fun'
-    avatar_url = f'{base_url}/avatars/{user_id}/{hashed_filename}'
 
-    return {'url': avatar_url}
+@router.get(
+    path='/avatar/status',
+    response_model=dict
+)
+async def avatar_status(payload: dict = Depends(login_required)):
+    # processing, failed (with the reason) or done
+    job = await AvatarJob.get(payload['user_id'])
+    if job is None:
+        return {'status': 'done'}
+    if job.status == FAILED:
+        return {'status': 'failed', 'detail': job.last_error}
+    return {'status': 'processing'}
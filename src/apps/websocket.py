@@ -1,24 +1,191 @@
-from typing import Any
+import asyncio
+
+from typing import Any, Optional
 from fastapi import WebSocket
 
+from config import config
+from src.encoder import dumps
+from src.logger import get_logger
+from src.services.broadcast import get_backend
+
+logger = get_logger(__name__)
+
+
+class Connection:
+    # socket with its own bounded outbound queue,
+    # drained by a dedicated writer task
+
+    __slots__ = ('queue', 'room', 'task', 'ws')
+
+    def __init__(self, room: str, ws: WebSocket, size: int):
+        self.ws = ws
+        self.room = room
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+        self.task: Optional[asyncio.Task] = None
+
 
 class WebSocketManager:
-    def __init__(self):
-        self._connects: dict[str, list[WebSocket]] = {}
+    def __init__(
+        self,
+        backend: str = 'local',
+        queue_size: int = 64,
+        send_timeout: int = 5000
+    ):
+        self._connects: dict[str, list[Connection]] = {}
+        self._sockets: dict[WebSocket, Connection] = {}
+        self._closing: set[asyncio.Task] = set()
+
+        self.backend = get_backend(backend)
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout / 1000  # ms -> sec
+
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'overflow': 0,  # evicted, queue was full
+            'timeout': 0  # evicted, send took too long
+        }
+
+    async def start(self) -> None:
+        await self.backend.start(self._deliver)
+
+    async def close(self) -> None:
+        for conn in list(self._sockets.values()):
+            conn.task.cancel()
+
+        self._connects.clear()
+        self._sockets.clear()
+        await self.backend.close()
 
     async def connect(self, room: str, ws: WebSocket):
         await ws.accept()
-        self._connects.setdefault(room, []).append(ws)
 
-    def disconnect(self, room: str, ws: WebSocket):
-        conns = self._connects.get(room)
-        if conns and ws in conns:
-            conns.remove(ws)
+        conn = Connection(room, ws, self.queue_size)
+        conn.task = asyncio.create_task(self._writer(conn))
+
+        self._sockets[ws] = conn
+        conns = self._connects.setdefault(room, [])
+        conns.append(conn)
+
+        if len(conns) == 1:
+            # first local socket, start receiving room events
+            await self.backend.join(room)
+
+    async def disconnect(self, room: str, ws: WebSocket):
+        conn = self._sockets.get(ws)
+        if conn is None:
+            return
+
+        empty = self._detach(conn, stop=False)
+        # out of the room already, but what is queued (e.g. a last
+        # reply before the handler returns) still goes out
+        await self._drain(conn)
+        conn.task.cancel()
+
+        if empty:
+            await self.backend.leave(room)
+
+    async def _drain(self, conn: Connection) -> None:
+        if conn.queue.empty() or conn.task.done():
+            return
+
+        # until the queue is sent, the writer gives up or time is out
+        sent = asyncio.ensure_future(conn.queue.join())
+        await asyncio.wait(
+            (sent, conn.task),
+            timeout=self.send_timeout,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        sent.cancel()
+
+    def _detach(self, conn: Connection, stop: bool = True) -> bool:
+        # returns True when the room has no local sockets left
+        if self._sockets.pop(conn.ws, None) is None:
+            return False
+
+        if stop and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+
+        conns = self._connects.get(conn.room, [])
+        if conn in conns:
+            conns.remove(conn)
+
+        if conns:
+            return False
+
+        self._connects.pop(conn.room, None)
+        return True
+
+    async def close_room(self, room: str, code: int = 1000) -> None:
+        # closes the local sockets of a room, their handlers clean up
+        for conn in list(self._connects.get(room, [])):
+            try:
+                await conn.ws.close(code=code)
+            except Exception:
+                pass
+
+    async def send(self, ws: WebSocket, message: dict[str, Any]) -> None:
+        # reply to one socket, ordered with the room broadcasts
+        conn = self._sockets.get(ws)
+        if conn is not None:
+            self._enqueue(conn, dumps(message).decode())
+
+    async def broadcast(self, room: str, message: dict[str, Any]) -> None:
+        # encoded once, the same frame goes to every socket
+        await self.backend.publish(room, dumps(message).decode())
+
+    async def _deliver(self, room: str, frame: str) -> None:
+        for conn in list(self._connects.get(room, [])):
+            self._enqueue(conn, frame)
+
+    def _enqueue(self, conn: Connection, frame: str) -> None:
+        try:
+            conn.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.stats['overflow'] += 1
+            self._evict(conn, 'outbound queue is full')
+
+    async def _writer(self, conn: Connection) -> None:
+        while True:
+            frame = await conn.queue.get()
+
+            try:
+                await asyncio.wait_for(
+                    conn.ws.send_text(frame),
+                    timeout=self.send_timeout
+                )
+            except TimeoutError:
+                self.stats['timeout'] += 1
+                self._evict(conn, 'send timed out')
+                return
+            except Exception:
+                # socket is gone, the handler will disconnect it
+                self.stats['failed'] += 1
+                return
+
+            self.stats['sent'] += 1
+            conn.queue.task_done()
+
+    def _evict(self, conn: Connection, reason: str) -> None:
+        logger.warning(f'Evicting slow client from {conn.room}: {reason}')
+        empty = self._detach(conn)
+
+        async def _close():
+            if empty:
+                await self.backend.leave(conn.room)
+            try:
+                await conn.ws.close(code=1013)  # try again later
+            except Exception:
+                pass
 
-    async def broadcast(self, room: str, message: list[str, Any]) -> None:
-        for ws in self._connects.get(room, []):
-            await ws.send_json(message)
+        task = asyncio.create_task(_close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
 
 
 # global instance of WebSocketManager
-manager = WebSocketManager()
+manager = WebSocketManager(
+    config.ws_backend,
+    config.ws_queue_size,
+    config.ws_send_timeout
+)
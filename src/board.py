@@ -0,0 +1,27 @@
+from src.model import Model
+from pydantic import ConfigDict
+
+__all__ = ('BOARD', 'NO_OWNER', 'Property')
+
+NO_OWNER = -1  # marker in Game.owners for a free property
+
+
+class Property(Model):
+    # static part of a board field, shared by every game
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    name: str
+    price: int
+    rent: tuple[int, ...]
+
+
+BOARD: tuple[Property, ...] = tuple(
+    Property(
+        id=i,
+        name=f'Field {i}',
+        price=100 + i*10,
+        rent=(10, 20, 30)
+    )
+    for i in range(40)
+)
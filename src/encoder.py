@@ -0,0 +1,37 @@
+import json
+import orjson
+
+from typing import Any, Callable
+
+from config import config
+from fastapi.responses import JSONResponse
+
+__all__ = ('FastJSONResponse', 'dumps', 'loads')
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(',', ':')
+    ).encode()
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+_encoders: dict[str, tuple[Callable[[Any], bytes], Callable]] = {
+    'json': (_json_dumps, json.loads),
+    'orjson': (_orjson_dumps, orjson.loads)
+}
+
+try:
+    dumps, loads = _encoders[config.json_encoder]
+except KeyError:
+    raise RuntimeError(f'Unknown JSON encoder: {config.json_encoder}')
+
+
+class FastJSONResponse(JSONResponse):
+    # default response class, encodes with the configured encoder
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
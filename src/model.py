@@ -1,6 +1,11 @@
+import functools
+
 from pydantic import BaseModel, ConfigDict
 
-__all__ = ('Model',)
+from types import UnionType
+from typing import Any, Optional, Self, Union, get_args, get_origin
+
+__all__ = ('Model', 'View')
 
 
 class Model(BaseModel):
@@ -13,3 +18,70 @@ class Model(BaseModel):
 
     def to_dict(self, **kwargs) -> dict:
         return self.model_dump(mode='json', **kwargs)
+
+
+def _model_of(annotation: Any) -> Optional[type[BaseModel]]:
+    # the model inside X, Optional[X] or list[X], if any
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    if get_origin(annotation) in (list, tuple, Union, UnionType):
+        for arg in get_args(annotation):
+            model = _model_of(arg)
+            if model is not None:
+                return model
+    return None
+
+
+class View(Model):
+    # read model over part of a stored document, declared next to the
+    # document it reads. Only its own fields are fetched (nested views
+    # as dotted paths) and validated, skipping the rest of the document.
+    # Plain validation is kept on purpose: pydantic-core builds these
+    # small models faster than model_construct() does
+    #
+    #   class GameSeats(View):
+    #       max_players: int
+    #       players: list[PlayerId]
+    #
+    #   seats = await GameSeats.find_one(Game, {'_id': game_id})
+
+    @classmethod
+    @functools.cache
+    def _paths(cls) -> tuple[str, ...]:
+        # fixed per class, worked out once
+        paths = []
+        for name, field in cls.model_fields.items():
+            key = field.alias or name
+            nested = _model_of(field.annotation)
+            if nested is not None and issubclass(nested, View):
+                paths.extend(f'{key}.{path}' for path in nested._paths())
+            else:
+                paths.append(key)
+        return tuple(paths)
+
+    @classmethod
+    def projection(cls) -> dict[str, int]:
+        fields = dict.fromkeys(cls._paths(), 1)
+        # mongo returns _id unless told otherwise
+        fields.setdefault('_id', 0)
+        return fields
+
+    @classmethod
+    async def find_one(cls, document: Any, query: dict) -> Optional[Self]:
+        data = await document.get_motor_collection().find_one(
+            query, cls.projection()
+        )
+        return None if data is None else cls.model_validate(data)
+
+    @classmethod
+    async def find(
+        cls,
+        document: Any,
+        query: dict,
+        sort: Optional[list[tuple[str, int]]] = None,
+        limit: int = 0
+    ) -> list[Self]:
+        cursor = document.get_motor_collection().find(
+            query, cls.projection(), sort=sort, limit=limit
+        )
+        return [cls.model_validate(data) async for data in cursor]
@@ -0,0 +1,65 @@
+import time
+
+from src.logger import get_logger
+
+from typing import Optional
+
+logger = get_logger(__name__)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # closed: calls go through, `failures` errors in a row open it.
+    # open: calls fail fast with CircuitOpenError for `reset_timeout`
+    # seconds, then one trial call (half-open) decides what's next
+    #
+    #   with breaker:
+    #       await call_upstream()
+
+    def __init__(self, name: str, failures: int, reset_timeout: float):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+
+        self._errors = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def __enter__(self) -> 'CircuitBreaker':
+        state = self.state
+        if state == 'open' or (state == 'half-open' and self._trial):
+            raise CircuitOpenError(f'{self.name} circuit is open')
+
+        if state == 'half-open':
+            self._trial = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._trial = False
+        if exc_type is None:
+            if self._opened_at is not None:
+                logger.info(f'{self.name} circuit closed')
+            self._errors = 0
+            self._opened_at = None
+            return
+
+        if not issubclass(exc_type, Exception):
+            return  # cancelled, says nothing about the upstream
+
+        self._errors += 1
+        if self._opened_at is not None or self._errors >= self.failures:
+            if self._opened_at is None:
+                logger.warning(f'{self.name} circuit opened after '
+                               f'{self._errors} failures: {exc!r}')
+            self._opened_at = time.monotonic()
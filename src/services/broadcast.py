@@ -0,0 +1,93 @@
+import asyncio
+
+from src.services import cache
+from src.logger import get_logger
+
+from typing import Awaitable, Callable, Optional
+
+logger = get_logger(__name__)
+
+# receives (room, pre-encoded JSON frame)
+Deliver = Callable[[str, str], Awaitable[None]]
+
+
+class LocalBroadcast:
+    # in-process fan-out, rooms are visible to one worker only
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def close(self) -> None:
+        pass
+
+    async def join(self, room: str) -> None:
+        pass
+
+    async def leave(self, room: str) -> None:
+        pass
+
+    async def publish(self, room: str, frame: str) -> None:
+        await self._deliver(room, frame)
+
+
+class RedisBroadcast:
+    # cross-worker fan-out: every event goes through redis pub/sub,
+    # each worker listens only to the rooms it has local sockets in
+
+    prefix = 'ws:'
+
+    def __init__(self):
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        if cache.redis is None:
+            raise RuntimeError('Redis broadcast requires redis_uri')
+
+        self._pubsub = cache.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.connect()
+        self._task = asyncio.create_task(self._listen(deliver))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def join(self, room: str) -> None:
+        await self._pubsub.subscribe(f'{self.prefix}{room}')
+
+    async def leave(self, room: str) -> None:
+        await self._pubsub.unsubscribe(f'{self.prefix}{room}')
+
+    async def publish(self, room: str, frame: str) -> None:
+        await cache.redis.publish(f'{self.prefix}{room}', frame)
+
+    async def _listen(self, deliver: Deliver) -> None:
+        while True:
+            try:
+                msg = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f'Redis pub/sub failed: {exc}')
+                await asyncio.sleep(1)
+                continue
+
+            if not msg or msg['type'] != 'message':
+                continue
+
+            room = msg['channel'].removeprefix(self.prefix)
+            try:
+                await deliver(room, msg['data'])
+            except Exception:
+                logger.exception(f'Failed to deliver to room {room}')
+
+
+def get_backend(name: str) -> LocalBroadcast | RedisBroadcast:
+    if name == 'redis':
+        return RedisBroadcast()
+    return LocalBroadcast()
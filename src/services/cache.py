@@ -1,8 +1,22 @@
-from typing import Optional
+import time
+import asyncio
+import functools
+
+from config import config
+from src.logger import get_logger
+from src.encoder import dumps, loads
+
+from pydantic import BaseModel
 from redis.asyncio import Redis
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+logger = get_logger(__name__)
 
 redis: Optional[Redis] = None
 
+MISSING = object()  # nothing cached, as opposed to a cached None
+
 
 async def init_redis(uri: str) -> None:
     global redis
@@ -14,3 +28,175 @@ async def init_redis(uri: str) -> None:
         raise RuntimeError(
             f'Failed to connect to Redis at {uri}: {exc}'
         )
+
+
+class Cache:
+    # read-through cache: small in-process LRU (L1) in front of
+    # redis (L2), L2 is skipped when redis is not configured.
+    # L1 entries are short-lived, other workers only see an
+    # invalidation once their own L1 copy expires
+
+    def __init__(
+        self,
+        maxsize: int,
+        l1_ttl: int,
+        ttl: int,
+        negative_ttl: int
+    ):
+        self.maxsize = maxsize
+        self.l1_ttl = l1_ttl
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.hits = {'l1': 0, 'l2': 0}
+        self.misses = 0
+
+        self._l1: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._flights: dict[str, asyncio.Future] = {}
+
+    def _l1_get(self, key: str) -> Any:
+        item = self._l1.get(key)
+        if item is None:
+            return MISSING
+
+        if item[0] <= time.monotonic():
+            del self._l1[key]
+            return MISSING
+
+        self._l1.move_to_end(key)
+        return item[1]
+
+    def _l1_set(self, key: str, value: Any, ttl: int) -> None:
+        expires = time.monotonic() + min(ttl, self.l1_ttl)
+        self._l1[key] = (expires, value)
+        self._l1.move_to_end(key)
+
+        if len(self._l1) > self.maxsize:
+            self._l1.popitem(last=False)
+
+    async def get(self, key: str) -> Any:
+        value = self._l1_get(key)
+        if value is not MISSING:
+            self.hits['l1'] += 1
+            return value
+
+        if redis is not None:
+            try:
+                raw = await redis.get(key)
+            except Exception as exc:
+                logger.error(f'Cache read failed for {key}: {exc}')
+                raw = None
+
+            if raw is not None:
+                self.hits['l2'] += 1
+                value = loads(raw)
+                ttl = self.ttl if value is not None else self.negative_ttl
+                self._l1_set(key, value, ttl)
+                return value
+
+        self.misses += 1
+        return MISSING
+
+    async def set(self, key: str, value: Any,
+                  ttl: Optional[int] = None) -> None:
+        # `value` must be JSON-serializable, None is cached as negative
+        if ttl is None:
+            ttl = self.ttl if value is not None else self.negative_ttl
+
+        self._l1_set(key, value, ttl)
+        if redis is not None:
+            try:
+                await redis.set(key, dumps(value).decode(), ex=ttl)
+            except Exception as exc:
+                logger.error(f'Cache write failed for {key}: {exc}')
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._l1.pop(key, None)
+
+        if redis is not None and keys:
+            try:
+                await redis.delete(*keys)
+            except Exception as exc:
+                logger.error(f'Cache delete failed for {keys}: {exc}')
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None
+    ) -> Any:
+        value = await self.get(key)
+        if value is not MISSING:
+            return value
+
+        # single flight: concurrent misses share one loader call
+        flight = self._flights.get(key)
+        if flight is not None:
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise  # this caller was cancelled
+                # the loading caller was, take over from it
+                return await self.get_or_load(key, loader, ttl)
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+
+        try:
+            value = await loader()
+            await self.set(key, value, ttl)
+        except Exception as exc:
+            flight.set_exception(exc)
+            # nobody else may be waiting, don't warn about it
+            flight.exception()
+            raise
+        else:
+            flight.set_result(value)
+        finally:
+            # cancelled loader: don't leave the waiters hanging
+            if not flight.done():
+                flight.cancel()
+            del self._flights[key]
+
+        return value
+
+
+cache = Cache(
+    config.cache_l1_size,
+    config.cache_l1_ttl,
+    config.cache_ttl,
+    config.cache_negative_ttl
+)
+
+
+def _dump(model: BaseModel) -> dict:
+    return model.model_dump(mode='json')
+
+
+def cached(
+    key: str,
+    ttl: Optional[int] = None,
+    model: Optional[type[BaseModel]] = None
+):
+    # caches the result of an async function under `key`,
+    # formatted with its arguments, e.g. cached('user:{0}')
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async def load():
+                result = await func(*args, **kwargs)
+                if model is not None and result is not None:
+                    return _dump(result)
+                return result
+
+            value = await cache.get_or_load(
+                key.format(*args, **kwargs), load, ttl
+            )
+            if model is not None and value is not None:
+                return model.model_validate(value)
+            return value
+
+        return wrapper
+    return decorator
@@ -1,75 +1,197 @@
 import json
-import resend
+import time
 import aiohttp
 
 from config import config
 from src.logger import get_logger
+from src.services.cache import MISSING, Cache
+from src.services.outbox import outbox
+from src.services.breaker import CircuitBreaker, CircuitOpenError
 
-logger = get_logger(__name__)
-
-resend.api_key = config.resend_api_key
-timeout = aiohttp.ClientTimeout(total=10)
-
-try:
-    _proxies_path = 'src/proxies.json'
-    with open(_proxies_path, 'r', encoding='utf-8') as f:
-        _proxies: list[str] = json.load(f)
-except FileNotFoundError:
-    _proxies = {}
+from functools import partial
+from typing import Optional
 
-_proxy_index = 0
-_proxy_usage = 0
-
-
-def _next_proxy() -> str | None:
-    global _proxy_index, _proxy_usage
-    if not _proxies:
-        return None
+logger = get_logger(__name__)
 
-    proxy = _proxies[_proxy_index]
-    logger.debug(f'🔄 Using proxy: {proxy}')
-    _proxy_usage += 1
 
-    if _proxy_usage >= 3:
-        _proxy_usage = 0
-        _proxy_index = (_proxy_index + 1) % len(_proxies)
+def _load_proxies(path: str) -> list[str]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+class ProxyPool:
+    # round robin over healthy proxies, a proxy that failed sits out
+    # `cooldown` seconds, doubled with every further failure in a row.
+    # nothing here awaits, so concurrent requests can't interleave
+
+    def __init__(self, proxies: list[str], cooldown: float):
+        self.proxies = proxies
+        self.cooldown = cooldown
+
+        self._index = 0
+        self._fails = dict.fromkeys(proxies, 0)
+        self._benched: dict[str, float] = {}  # proxy -> back at
+
+    @property
+    def healthy(self) -> int:
+        now = time.monotonic()
+        return sum(self._benched.get(p, 0) <= now for p in self.proxies)
+
+    def next(self) -> Optional[str]:
+        if not self.proxies:
+            return None
+
+        now = time.monotonic()
+        for _ in range(len(self.proxies)):
+            proxy = self.proxies[self._index]
+            self._index = (self._index + 1) % len(self.proxies)
+            if self._benched.get(proxy, 0) <= now:
+                return proxy
+
+        # all of them are benched, take the one that's back first
+        return min(self._benched, key=self._benched.__getitem__)
+
+    def success(self, proxy: Optional[str]) -> None:
+        if proxy is not None:
+            self._fails[proxy] = 0
+            self._benched.pop(proxy, None)
+
+    def failure(self, proxy: Optional[str]) -> None:
+        if proxy is not None:
+            self._fails[proxy] += 1
+            backoff = self.cooldown * 2 ** min(self._fails[proxy] - 1, 5)
+            self._benched[proxy] = time.monotonic() + backoff
+
+
+class EmailVerifier:
+    # existence check against an external API. Verdicts are cached
+    # per address, concurrent checks of one address share a request.
+    # When the API is down (or the circuit is open) the answer comes
+    # from the domain cache: a domain with a recently confirmed
+    # address passes, unknown ones get `fallback`
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float,
+        fallback: bool,
+        domain_ttl: int,
+        cache: Cache,
+        breaker: CircuitBreaker,
+        proxies: ProxyPool
+    ):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.fallback = fallback
+        self.domain_ttl = domain_ttl
+
+        self.cache = cache
+        self.breaker = breaker
+        self.proxies = proxies
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(ttl_dns_cache=300)
+            )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def exists(self, email: str) -> bool:
+        email = email.lower()
+        domain = email.rsplit('@', 1)[-1]
 
-    return proxy
+        try:
+            return await self.cache.get_or_load(
+                f'email:{email}', partial(self._lookup, email, domain)
+            )
+        except (CircuitOpenError, aiohttp.ClientError,
+                TimeoutError, ValueError) as exc:
+            verdict = await self.cache.get(f'email-domain:{domain}')
+            if verdict is MISSING:
+                verdict = self.fallback
+
+            logger.warning(f'Email check unavailable ({exc!r}), '
+                           f'{domain} -> {verdict}')
+            return verdict
+
+    async def _lookup(self, email: str, domain: str) -> bool:
+        with self.breaker:
+            proxy = self.proxies.next()
+            try:
+                exists = await self._fetch(email, proxy)
+            except (aiohttp.ClientConnectionError, TimeoutError):
+                self.proxies.failure(proxy)
+                raise
+            self.proxies.success(proxy)
+
+        if exists:
+            await self.cache.set(
+                f'email-domain:{domain}', True, self.domain_ttl
+            )
+        return exists
+
+    async def _fetch(self, email: str, proxy: Optional[str]) -> bool:
+        if self._session is None:
+            # not started (scripts, tests): short-lived session
+            async with aiohttp.ClientSession(timeout=self.timeout) as s:
+                return await self._get(s, email, proxy)
+        return await self._get(self._session, email, proxy)
+
+    async def _get(
+        self,
+        session: aiohttp.ClientSession,
+        email: str,
+        proxy: Optional[str]
+    ) -> bool:
+        async with session.get(
+            self.url,
+            params={'email': email},
+            proxy=proxy
+        ) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+        return bool(data.get('exist'))
+
+
+verifier = EmailVerifier(
+    config.email_check_url,
+    config.email_check_timeout,
+    config.email_check_fallback,
+    config.email_domain_ttl,
+    cache=Cache(
+        config.email_cache_size,
+        config.email_cache_ttl,
+        config.email_cache_ttl,
+        config.email_cache_ttl
+    ),
+    breaker=CircuitBreaker(
+        'email check',
+        config.email_breaker_failures,
+        config.email_breaker_reset
+    ),
+    proxies=ProxyPool(
+        _load_proxies('src/proxies.json'),
+        config.email_proxy_cooldown
+    )
+)
 
 
 async def email_exists(email: str) -> bool:
-    url = 'https://api.2ip.ua/email.json'
-
-    async with aiohttp.ClientSession(
-        timeout=timeout,  # need to add a proxy
-    ) as session:
-        try:
-            params = {'email': email}
-            async with session.get(
-                url,
-                params=params,
-                proxy=_next_proxy()
-            ) as response:
-                text = await response.text()
-                logger.debug('<<< quote raw response:\n%s', text)
-
-                response.raise_for_status()
-                data = await response.json()
-        except aiohttp.ClientResponseError as e:
-            logger.error(f'[{e.status}][{e.message}] :: {e.request_info.url}')
-            return False
-        except aiohttp.ClientError as e:
-            logger.error(e)
-            return False
-
-    return bool(data.get('exist'))
+    return await verifier.exists(email)
 
 
 async def send_verification_email(email: str, token: str) -> None:
-    if not (config.resend_sender and config.resend_api_key):
-        logger.warning('Resend configuration is not set')
-        return
-
     verify_link = f'http://127.0.0.1:8000/users/verify/{token}'
 
     html = (
@@ -77,12 +199,5 @@ async def send_verification_email(email: str, token: str) -> None:
         f'<a href="{verify_link}">here</a>.</p>'
     )
 
-    params: resend.Emails.SendParams = {
-        'from': config.resend_sender,
-        'to': email,
-        'subject': '✅ Confirm your email',
-        'html': html
-    }
-
-    result: resend.Email = resend.Emails.send(params)
-    return result
+    # sent in the background by outbox workers
+    await outbox.enqueue(email, '✅ Confirm your email', html)
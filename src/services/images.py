@@ -0,0 +1,85 @@
+import io
+
+from config import config
+from src.logger import get_logger
+from src.services.pool import PoolBusyError, ProcessPool
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = get_logger(__name__)
+
+MAX_PIXELS = 40_000_000  # decompression bomb guard, ~6300x6300
+
+
+class ImageError(ValueError):
+    pass
+
+
+class ImageBusyError(PoolBusyError):
+    pass
+
+
+def _variants(
+    data: bytes,
+    sizes: tuple[int, ...],
+    quality: int
+) -> dict[int, bytes]:
+    # runs in a worker process: decode, square crop and encode
+    # one WebP per size. Re-encoding drops EXIF, ICC and the rest
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    try:
+        with Image.open(io.BytesIO(data)) as src:
+            # only the header is read so far. Pillow itself just warns
+            # up to twice MAX_IMAGE_PIXELS, refuse before decoding
+            if src.width * src.height > MAX_PIXELS:
+                raise ImageError('Image is too large')
+
+            src.seek(0)  # first frame of animated images
+            image = ImageOps.exif_transpose(src)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or \
+                'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+    except (UnidentifiedImageError, Image.DecompressionBombError,
+            OSError, SyntaxError) as exc:
+        logger.info(f'Rejected image: {exc}')
+        raise ImageError('Invalid image file')
+
+    result = {}
+    for size in sorted(sizes, reverse=True):
+        # downscale from the previous (larger) variant, it's cheaper
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=quality, method=4)
+        result[size] = out.getvalue()
+
+    return result
+
+
+class ImageProcessor(ProcessPool):
+    # avatar resizing off the event loop
+
+    busy_error = ImageBusyError
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        sizes: tuple[int, ...],
+        quality: int
+    ):
+        super().__init__(workers, max_pending)
+        self.sizes = tuple(sizes)
+        self.quality = quality
+
+    async def variants(self, data: bytes) -> dict[int, bytes]:
+        # {size: webp bytes}, raises ImageError for broken input
+        return await self.run(_variants, data, self.sizes, self.quality)
+
+
+images = ImageProcessor(
+    config.image_workers,
+    config.image_max_pending,
+    config.avatar_sizes,
+    config.avatar_quality
+)
@@ -0,0 +1,78 @@
+import importlib
+
+from src.logger import get_logger
+
+from beanie import Document
+from beanie.odm.fields import IndexModelField
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+logger = get_logger(__name__)
+
+Spec = tuple[tuple[tuple[str, int | str], ...], bool]
+
+
+def _model(path: str | type[Document]) -> type[Document]:
+    # same dotted paths as init_beanie takes
+    if isinstance(path, str):
+        module, name = path.rsplit('.', 1)
+        return getattr(importlib.import_module(module), name)
+    return path
+
+
+def _spec(key, unique) -> Spec:
+    # comparable form of an index: fields with directions + uniqueness
+    fields = tuple(
+        (field, int(d) if isinstance(d, float) else d)
+        for field, d in (key.items() if hasattr(key, 'items') else key)
+    )
+    return fields, bool(unique)
+
+
+async def ensure_indexes(
+    models: list[str | type[Document]]
+) -> dict[str, dict[str, list[str]]]:
+    # creates the indexes declared in Settings.indexes one at a time,
+    # so one that can't be built (e.g. duplicates under a unique key)
+    # doesn't hold back the others, then reports per collection what
+    # is declared but missing and what exists but isn't declared.
+    # Nothing is ever dropped
+    report = {}
+
+    for path in models:
+        model = _model(path)
+        collection = model.get_motor_collection()
+        declared: list[IndexModel] = IndexModelField.list_to_index_model(
+            model.get_settings().indexes or []
+        )
+
+        for index in declared:
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as exc:
+                logger.error(f'Failed to create index '
+                             f'{collection.name}.{index.document["name"]}: '
+                             f'{exc}')
+
+        existing = {
+            _spec(info['key'], info.get('unique')): name
+            for name, info in (await collection.index_information()).items()
+            if name != '_id_'
+        }
+        wanted = {
+            _spec(index.document['key'], index.document.get('unique')):
+                index.document['name']
+            for index in declared
+        }
+
+        missing = [n for spec, n in wanted.items() if spec not in existing]
+        extra = [n for spec, n in existing.items() if spec not in wanted]
+        report[collection.name] = {'missing': missing, 'extra': extra}
+
+        if missing:
+            logger.error(f'Missing indexes on {collection.name}: {missing}')
+        if extra:
+            logger.warning(f'Undeclared indexes on {collection.name}: '
+                           f'{extra}')
+
+    return report
@@ -0,0 +1,243 @@
+import uuid
+import asyncio
+import resend
+
+from config import config
+from src.utils import tmsnow
+from src.logger import get_logger
+
+from typing import Optional, Protocol
+from beanie import Document
+from pydantic import Field
+from pymongo import IndexModel, UpdateOne
+
+logger = get_logger(__name__)
+
+PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+
+
+class EmailMessage(Document):
+    # outbox entry, a worker owns it while `available_at` is ahead
+    to: str
+    subject: str
+    html: str
+
+    status: str = PENDING  # pending, sent, failed
+    attempts: int = 0
+    available_at: int = Field(default_factory=tmsnow)
+    last_error: Optional[str] = None
+    provider_id: Optional[str] = None
+    claim: Optional[str] = None  # token of the worker's last claim
+
+    created_at: int = Field(default_factory=tmsnow)
+    sent_at: Optional[int] = None
+
+    class Settings:
+        name = 'email_outbox'
+        indexes = (
+            IndexModel([('status', 1), ('available_at', 1)]),
+        )
+
+
+class Provider(Protocol):
+    batch_size: int
+
+    async def send(self, messages: list[EmailMessage]) -> list[str]:
+        # provider ids in the same order, raises if nothing was sent
+        ...
+
+
+class ResendProvider:
+    batch_size = 100  # resend batch API limit
+
+    def __init__(self, sender: str, api_key: str):
+        self.sender = sender
+        resend.api_key = api_key
+
+    def _params(self, message: EmailMessage) -> resend.Emails.SendParams:
+        return {
+            'from': self.sender,
+            'to': message.to,
+            'subject': message.subject,
+            'html': message.html
+        }
+
+    async def send(self, messages: list[EmailMessage]) -> list[str]:
+        # the SDK is blocking, keep it off the event loop
+        if len(messages) == 1:
+            result = await asyncio.to_thread(
+                resend.Emails.send, self._params(messages[0])
+            )
+            return [result['id']]
+
+        result = await asyncio.to_thread(
+            resend.Batch.send, [self._params(m) for m in messages]
+        )
+        return [item['id'] for item in result['data']]
+
+
+class LogProvider:
+    # nothing configured (local runs): log instead of sending
+    batch_size = 100
+
+    async def send(self, messages: list[EmailMessage]) -> list[str]:
+        for message in messages:
+            logger.info(f'Email to {message.to}: {message.subject}')
+        return [str(message.id) for message in messages]
+
+
+def get_provider(name: str) -> Provider:
+    if name == 'resend':
+        if config.resend_sender and config.resend_api_key:
+            return ResendProvider(
+                config.resend_sender, config.resend_api_key
+            )
+        logger.warning('Resend configuration is not set')
+    return LogProvider()
+
+
+class Outbox:
+    # emails are stored first and sent by background workers:
+    # batched, at most `workers` provider calls at once, retried
+    # with exponential backoff. A claimed message is hidden for
+    # `lease` seconds, so one left behind by a crash is sent again
+
+    def __init__(
+        self,
+        provider: Provider,
+        workers: int,
+        poll_interval: float,
+        lease: int,
+        max_attempts: int,
+        backoff: int
+    ):
+        self.provider = provider
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    async def enqueue(self, to: str, subject: str, html: str) -> None:
+        await EmailMessage(to=to, subject=subject, html=html).insert()
+        self._wake.set()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker())
+                for _ in range(self.workers)
+            ]
+
+    async def close(self) -> None:
+        # unsent messages stay in the outbox for the next start
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _claim(self, limit: int) -> list[EmailMessage]:
+        # three round-trips per batch: pick the due ids, stamp them
+        # with a token in one update (the filter repeats the due check,
+        # so concurrent workers never claim the same message), then
+        # read back what this token actually won
+        collection = EmailMessage.get_motor_collection()
+        token = uuid.uuid4().hex
+        now = tmsnow()
+        due = {'status': PENDING, 'available_at': {'$lte': now}}
+
+        ids = [
+            doc['_id'] async for doc in collection.find(
+                due, {'_id': 1}, sort=[('available_at', 1)], limit=limit
+            )
+        ]
+        if not ids:
+            return []
+
+        await collection.update_many(
+            {'_id': {'$in': ids}, **due},
+            {
+                '$set': {'available_at': now + self.lease, 'claim': token},
+                '$inc': {'attempts': 1}
+            }
+        )
+        return [
+            EmailMessage.model_validate(doc) async for doc in collection.find(
+                {'_id': {'$in': ids}, 'claim': token}
+            )
+        ]
+
+    async def _worker(self) -> None:
+        while True:
+            # cleared before looking, so an enqueue() from now on
+            # ends the wait below right away
+            self._wake.clear()
+            try:
+                batch = await self._claim(self.provider.batch_size)
+                if batch:
+                    await self._send(batch)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f'Email outbox worker failed: {exc}')
+
+            # idle: wait for enqueue() or poll for retries that are due
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), self.poll_interval
+                )
+            except TimeoutError:
+                pass
+
+    async def _send(self, batch: list[EmailMessage]) -> None:
+        collection = EmailMessage.get_motor_collection()
+
+        # the outcome of the whole batch goes back in one bulk write
+        try:
+            ids = await self.provider.send(batch)
+        except Exception as exc:
+            logger.error(f'Failed to send {len(batch)} emails: {exc}')
+            await collection.bulk_write([
+                self._retry(message, str(exc)) for message in batch
+            ], ordered=False)
+            return
+
+        now = tmsnow()
+        await collection.bulk_write([
+            UpdateOne({'_id': message.id}, {'$set': {
+                'status': SENT,
+                'provider_id': provider_id,
+                'sent_at': now,
+                'last_error': None
+            }})
+            for message, provider_id in zip(batch, ids, strict=True)
+        ], ordered=False)
+        self.stats['sent'] += len(batch)
+
+    def _retry(self, message: EmailMessage, error: str) -> UpdateOne:
+        update = {'last_error': error[:500]}
+        if message.attempts >= self.max_attempts:
+            update['status'] = FAILED
+            self.stats['failed'] += 1
+        else:
+            delay = self.backoff * 2 ** (message.attempts - 1)
+            update['available_at'] = tmsnow() + delay
+            self.stats['retried'] += 1
+
+        return UpdateOne({'_id': message.id}, {'$set': update})
+
+
+outbox = Outbox(
+    get_provider(config.email_provider),
+    config.email_workers,
+    config.email_poll_interval,
+    config.email_lease,
+    config.email_max_attempts,
+    config.email_backoff
+)
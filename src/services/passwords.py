@@ -0,0 +1,88 @@
+import os
+import hmac
+import base64
+import hashlib
+
+from config import config
+from src.logger import get_logger
+from src.services.pool import PoolBusyError, ProcessPool
+
+logger = get_logger(__name__)
+
+SCHEME = 'scrypt'
+
+
+class HasherBusyError(PoolBusyError):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r, dklen=32
+    )
+
+
+def _hash(password: str, n: int, r: int, p: int) -> str:
+    # runs in a worker process
+    salt = os.urandom(16)
+    key = _scrypt(password, salt, n, r, p)
+    return f'{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(key)}'
+
+
+def _verify(password: str, hashed: str) -> bool:
+    # runs in a worker process
+    if '$' not in hashed:
+        # legacy unsalted md5 hex digest
+        legacy = hashlib.md5(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, hashed)
+
+    scheme, n, r, p, salt, key = hashed.split('$')
+    if scheme != SCHEME:
+        return False
+
+    actual = _scrypt(
+        password, base64.b64decode(salt), int(n), int(r), int(p)
+    )
+    return hmac.compare_digest(actual, base64.b64decode(key))
+
+
+class PasswordHasher(ProcessPool):
+    # scrypt hashing off the event loop
+
+    busy_error = HasherBusyError
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        n: int,
+        r: int,
+        p: int
+    ):
+        super().__init__(workers, max_pending)
+        self.params = (n, r, p)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(_hash, password, *self.params)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(_verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        # legacy md5 or scrypt with outdated cost parameters
+        prefix = f'{SCHEME}${"$".join(map(str, self.params))}$'
+        return not hashed.startswith(prefix)
+
+
+hasher = PasswordHasher(
+    config.password_workers,
+    config.password_max_pending,
+    config.password_scrypt_n,
+    config.password_scrypt_r,
+    config.password_scrypt_p
+)
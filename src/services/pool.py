@@ -0,0 +1,62 @@
+import asyncio
+import multiprocessing
+
+from typing import Any, Callable, Optional, TypeVar
+from concurrent.futures import ProcessPoolExecutor
+
+T = TypeVar('T')
+
+
+class PoolBusyError(Exception):
+    # too many jobs queued, the caller should back off
+    pass
+
+
+class ProcessPool:
+    # CPU-bound jobs off the event loop, in a bounded process pool.
+    # Workers are spawned, jobs have to be module-level functions
+
+    busy_error: type[PoolBusyError] = PoolBusyError
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self.stats = {
+            'pending': 0,  # jobs queued or running right now
+            'done': 0,
+            'failed': 0,  # raised in the worker
+            'rejected': 0  # refused because the queue was full
+        }
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        if self.stats['pending'] >= self.max_pending:
+            self.stats['rejected'] += 1
+            raise self.busy_error(f'Too many jobs queued ({func.__name__})')
+
+        self.stats['pending'] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # without a pool (scripts, tests) fall back to a thread
+            result = await loop.run_in_executor(self._pool, func, *args)
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+        finally:
+            self.stats['pending'] -= 1
+
+        self.stats['done'] += 1
+        return result
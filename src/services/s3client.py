@@ -1,9 +1,10 @@
 from config import config
 from src.logger import get_logger
 
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 from typing import Optional, AsyncGenerator
 
+from aiobotocore.config import AioConfig
 from botocore.exceptions import ClientError
 from aiobotocore.session import get_session
 from aiobotocore.client import AioBaseClient
@@ -11,26 +12,65 @@ from aiobotocore.client import AioBaseClient
 logger = get_logger(__name__)
 
 
+class UploadTooLargeError(ValueError):
+    pass
+
+
 class S3Client:
     def __init__(
         self,
         access_key: str,
         secret_key: str,
         bucket_name: str,
-        region_name: str = 'eu-central-1'
+        region_name: str = 'eu-central-1',
+        max_pool_connections: int = 10,
+        connect_timeout: float = 60,
+        read_timeout: float = 60
     ):
         self.config = {
             'aws_access_key_id': access_key,
             'aws_secret_access_key': secret_key,
             'endpoint_url': f'https://s3.{region_name}.amazonaws.com',
-            'region_name': region_name
+            'region_name': region_name,
+            'config': AioConfig(
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                tcp_keepalive=True
+            )
         }
 
         self.session = get_session()
         self.bucket_name = bucket_name
 
+        # one long-lived client (and connection pool), see start()
+        self._client: Optional[AioBaseClient] = None
+        self._stack: Optional[AsyncExitStack] = None
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+
+        self._stack = AsyncExitStack()
+        self._client = await self._stack.enter_async_context(
+            self.session.create_client('s3', **self.config)
+        )
+
+    async def close(self) -> None:
+        if self._stack is not None:
+            stack, self._stack, self._client = self._stack, None, None
+            try:
+                await stack.aclose()
+            except Exception as exc:
+                logger.error(f'Failed to close S3 client: {exc}')
+
     @asynccontextmanager
     async def get_client(self) -> AsyncGenerator[AioBaseClient]:
+        if self._client is not None:
+            yield self._client
+            return
+
+        # not started (scripts, tests): short-lived client
         async with self.session.create_client('s3', **self.config) as client:
             yield client
 
@@ -65,6 +105,90 @@ class S3Client:
         logger.info(f'File {filename} uploaded to '
                     f'{self.bucket_name}/{object_name}')
 
+    async def presigned_post(
+        self,
+        filename: str,
+        object_id: str,
+        content_type: str,
+        max_size: int,
+        category: str = 'avatars',
+        expires: int = 300
+    ) -> dict:
+        # POST policy for a direct browser upload to the bucket,
+        # S3 itself rejects other content types and larger files
+        object_name = f'{category}/{object_id}/{filename}'
+        fields = {
+            'Content-Type': content_type,
+            'Content-Disposition': 'inline'
+        }
+
+        async with self.get_client() as client:
+            return await client.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=object_name,
+                Fields=fields,
+                Conditions=[
+                    {'Content-Type': content_type},
+                    {'Content-Disposition': 'inline'},
+                    ['content-length-range', 1, max_size]
+                ],
+                ExpiresIn=expires
+            )
+
+    async def download(
+        self,
+        filename: str,
+        object_id: str,
+        category: str = 'avatars',
+        max_size: Optional[int] = None
+    ) -> Optional[bytes]:
+        # object body, None if there is no such object
+        object_name = f'{category}/{object_id}/{filename}'
+
+        async with self.get_client() as client:
+            try:
+                resp = await client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=object_name
+                )
+            except ClientError as exc:
+                if exc.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    return None
+                logger.error(f'Failed to download file '
+                             f'{filename} from S3: {exc}')
+                raise
+
+            async with resp['Body'] as body:
+                if max_size is not None and \
+                        resp['ContentLength'] > max_size:
+                    raise UploadTooLargeError(
+                        f'File size exceeds limit of {max_size} bytes'
+                    )
+                return await body.read()
+
+    async def exists(
+        self,
+        filename: str,
+        object_id: str,
+        category: str = 'avatars'
+    ) -> bool:
+        # a HEAD request, the body stays in the bucket
+        object_name = f'{category}/{object_id}/{filename}'
+
+        async with self.get_client() as client:
+            try:
+                await client.head_object(
+                    Bucket=self.bucket_name,
+                    Key=object_name
+                )
+            except ClientError as exc:
+                if exc.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    return False
+                logger.error(f'Failed to look up file '
+                             f'{filename} in S3: {exc}')
+                raise
+        return True
+
     async def list_objects(
         self,
         object_id: str,
@@ -118,9 +242,39 @@ class S3Client:
         logger.info(f'File {filename} deleted '
                     f'from {self.bucket_name}/{object_name}')
 
+    async def delete_objects(self, keys: list[str]) -> None:
+        # batched delete, up to 1000 keys per request
+        if not keys:
+            return
+
+        async with self.get_client() as client:
+            for i in range(0, len(keys), 1000):
+                batch = keys[i:i + 1000]
+                try:
+                    resp = await client.delete_objects(
+                        Bucket=self.bucket_name,
+                        Delete={
+                            'Objects': [{'Key': key} for key in batch],
+                            'Quiet': True
+                        }
+                    )
+                except ClientError as exc:
+                    logger.error(f'Failed to delete {len(batch)} '
+                                 f'objects from S3: {exc}')
+                    raise
+
+                for error in resp.get('Errors', []):
+                    logger.error(f'Failed to delete {error["Key"]} '
+                                 f'from S3: {error.get("Message")}')
+
+        logger.info(f'{len(keys)} objects deleted from {self.bucket_name}')
+
 
 s3 = S3Client(
     config.aws_access_key,
     config.aws_secret_key,
-    config.aws_bucket_name
+    config.aws_bucket_name,
+    max_pool_connections=config.aws_max_pool_connections,
+    connect_timeout=config.aws_connect_timeout,
+    read_timeout=config.aws_read_timeout
 )
@@ -1,35 +1,237 @@
 import time
+import uuid
+import asyncio
 import threading
 
+from config import config
+from src.services import cache
+from src.logger import get_logger
+
+from typing import Optional
+
+logger = get_logger(__name__)
+
+EPOCH = 1735689600000  # Jan 1, 2025 UTC, in milliseconds
+
+# 41 bits of timestamp on top make 53 bits in total, so IDs stay
+# exact as JSON numbers in JS clients. The timestamp shift (12) is
+# the same as in the old 41 + 12 layout: new IDs sort after old ones
+DATACENTER_BITS = 2
+WORKER_BITS = 4
+SEQUENCE_BITS = 6
+
+MAX_DATACENTER = (1 << DATACENTER_BITS) - 1
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+WORKER_SHIFT = SEQUENCE_BITS
+DATACENTER_SHIFT = WORKER_BITS + SEQUENCE_BITS
+TIMESTAMP_SHIFT = DATACENTER_BITS + WORKER_BITS + SEQUENCE_BITS
+
+# touch the lease only while this process still owns it
+_RENEW = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+'''
+_RELEASE = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+class ClockError(RuntimeError):
+    pass
+
+
+class LeaseLostError(RuntimeError):
+    pass
+
 
 class Snowflake:
-    # snowflake-like ID generator
-    # (epoch set to Jan 1, 2025 UTC)
-
-    _sequence = 0
-    _epoch = 1735689600000  # milliseconds since epoch
-
-    _last_timestamp = -1
-    _lock = threading.Lock()
-
-    @classmethod
-    def _timestamp(cls) -> int:
-        return int(time.time() * 1000)
-
-    @classmethod
-    def generate(cls) -> int:
-        with cls._lock:
-            timestamp = cls._timestamp()
-            if timestamp == cls._last_timestamp:
-                cls._sequence = (cls._sequence + 1) & 0xFFF  # 12 bits sequence
-                if cls._sequence == 0:
-                    # wait next ms
-                    while timestamp <= cls._last_timestamp:
-                        timestamp = cls._timestamp()
+    # snowflake-like ID generator: timestamp, datacenter, worker and
+    # sequence. The worker comes from config or is leased in redis,
+    # so every process of a deployment gets its own.
+    #
+    # It never waits for the clock: when a millisecond is used up
+    # (or the clock steps back a little) IDs are taken from the next
+    # one, up to `max_lead` ms ahead of the real time
+
+    def __init__(
+        self,
+        datacenter: int,
+        worker: Optional[int],
+        max_lead: int,
+        lease_ttl: int
+    ):
+        if not 0 <= datacenter <= MAX_DATACENTER:
+            raise ValueError(f'Datacenter must be 0-{MAX_DATACENTER}')
+        if worker is not None and not 0 <= worker <= MAX_WORKER:
+            raise ValueError(f'Worker must be 0-{MAX_WORKER}')
+
+        self.datacenter = datacenter
+        self.worker = worker or 0
+        self.fixed = worker is not None
+        self.max_lead = max_lead
+        self.lease_ttl = lease_ttl
+
+        self._last = -1
+        self._sequence = 0  # next free sequence number in `_last`
+        self._lock = threading.Lock()
+
+        self._token = uuid.uuid4().hex
+        self._lease_key: Optional[str] = None
+        self._renewer: Optional[asyncio.Task] = None
+        self._confirmed_at = 0.0  # last successful lease/renewal
+
+    @staticmethod
+    def _now() -> int:
+        return time.time_ns() // 1_000_000
+
+    def _reserve(
+        self,
+        n: int,
+        max_lead: int
+    ) -> Optional[tuple[int, int, int]]:
+        # up to `n` sequence numbers of one millisecond, as
+        # (timestamp, first sequence, count). None if that would
+        # take the generator more than `max_lead` ms ahead
+        with self._lock:
+            now = self._now()
+            if self._last - now > self.max_lead:
+                raise ClockError(
+                    f'Clock moved backwards by {self._last - now} ms'
+                )
+
+            if now > self._last:
+                timestamp, sequence = now, 0
+            elif self._sequence <= MAX_SEQUENCE:
+                timestamp, sequence = self._last, self._sequence
             else:
-                cls._sequence = 0
+                timestamp, sequence = self._last + 1, 0
+
+            if timestamp - now > max_lead:
+                return None
+
+            count = min(n, MAX_SEQUENCE + 1 - sequence)
+            self._last, self._sequence = timestamp, sequence + count
+            return timestamp, sequence, count
+
+    def _pack(self, timestamp: int, sequence: int) -> int:
+        return ((timestamp - EPOCH) << TIMESTAMP_SHIFT) \
+            | (self.datacenter << DATACENTER_SHIFT) \
+            | (self.worker << WORKER_SHIFT) \
+            | sequence
+
+    def _check_lease(self) -> None:
+        # the lease may have expired and the worker moved on to
+        # another process, its IDs would collide with ours
+        if self._lease_key is not None and \
+                time.monotonic() - self._confirmed_at > self.lease_ttl / 1000:
+            raise LeaseLostError(f'{self._lease_key} lease is not renewed')
+
+    def generate(self) -> int:
+        self._check_lease()
+        reserved = self._reserve(1, self.max_lead)
+        if reserved is None:
+            # sustained more than 64 IDs per ms for max_lead ms
+            raise ClockError('ID generator is too far ahead of the clock')
+
+        timestamp, sequence, _ = reserved
+        return self._pack(timestamp, sequence)
+
+    async def generate_many(self, n: int) -> list[int]:
+        # a lock per millisecond worth of IDs rather than per ID.
+        # Leaves half of max_lead to generate() and sleeps instead
+        # of running further ahead
+        ids: list[int] = []
+        while len(ids) < n:
+            self._check_lease()
+            reserved = self._reserve(n - len(ids), self.max_lead // 2)
+            if reserved is None:
+                await asyncio.sleep(0.001)
+                continue
+
+            timestamp, sequence, count = reserved
+            first = self._pack(timestamp, sequence)
+            ids.extend(range(first, first + count))
+
+        return ids
+
+    async def start(self) -> None:
+        if self.fixed:
+            return
+
+        if cache.redis is None:
+            logger.warning('snowflake_worker is not set and there is no '
+                           'redis to lease one, IDs are only unique '
+                           'within a single process')
+            return
+
+        await self._lease()
+        self._renewer = asyncio.create_task(self._renew())
+
+    async def close(self) -> None:
+        if self._renewer is not None:
+            self._renewer.cancel()
+            await asyncio.gather(self._renewer, return_exceptions=True)
+            self._renewer = None
+
+        # don't hand the worker over while IDs from the future are out
+        lead = self._last - self._now()
+        if lead > 0:
+            await asyncio.sleep(lead / 1000)
+
+        if self._lease_key is not None and cache.redis is not None:
+            try:
+                await cache.redis.eval(
+                    _RELEASE, 1, self._lease_key, self._token
+                )
+            except Exception as exc:
+                logger.error(f'Failed to release {self._lease_key}: {exc}')
+            self._lease_key = None
+
+    async def _lease(self) -> None:
+        for worker in range(MAX_WORKER + 1):
+            key = f'snowflake:{self.datacenter}:{worker}'
+            if await cache.redis.set(
+                key, self._token, nx=True, px=self.lease_ttl
+            ):
+                self.worker, self._lease_key = worker, key
+                self._confirmed_at = time.monotonic()
+                logger.info(f'Leased snowflake worker {worker}')
+                return
+
+        raise RuntimeError(
+            f'All {MAX_WORKER + 1} snowflake workers of datacenter '
+            f'{self.datacenter} are leased'
+        )
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3000)
+            try:
+                started = time.monotonic()
+                owned = await cache.redis.eval(
+                    _RENEW, 1, self._lease_key, self._token, self.lease_ttl
+                )
+                if owned:
+                    self._confirmed_at = started
+                else:
+                    # someone else holds it already, stop right away
+                    self._confirmed_at = 0.0
+                    logger.error(f'Lost {self._lease_key}, leasing again')
+                    await self._lease()
+            except Exception as exc:
+                logger.error(f'Failed to renew {self._lease_key}: {exc}')
+
 
-            cls._last_timestamp = timestamp
-            # construct 64-bit id: 41 bits timestamp, 12 bits sequence
-            snowflake = ((timestamp - cls._epoch) << 12) | cls._sequence
-            return snowflake
+snowflake = Snowflake(
+    config.snowflake_datacenter,
+    config.snowflake_worker,
+    config.snowflake_max_lead,
+    config.snowflake_lease_ttl
+)
@@ -0,0 +1,257 @@
+# headless Monte Carlo simulator for the board economy,
+# usage: python -m src.simulate --games 1000000 --turns 200
+
+import json
+import argparse
+import numpy as np
+
+from typing import Optional
+from dataclasses import dataclass, field
+
+from src.board import BOARD, NO_OWNER
+
+START_BONUS = 200  # same as GameService.move_player
+START_BALANCE = 1500  # same as Player.balance
+
+
+@dataclass
+class Report:
+    games: int = 0
+    turns: int = 0
+    landings: np.ndarray = field(
+        default_factory=lambda: np.zeros(len(BOARD), np.int64)
+    )
+    purchases: np.ndarray = field(
+        default_factory=lambda: np.zeros(len(BOARD), np.int64)
+    )
+    rent_income: np.ndarray = field(
+        default_factory=lambda: np.zeros(len(BOARD), np.int64)
+    )
+    # turn of the first bankruptcy per game, -1 if nobody went broke
+    first_bankruptcy: list[np.ndarray] = field(default_factory=list)
+
+    def to_dict(self, prices: np.ndarray) -> dict:
+        spent = self.purchases * prices
+        first = np.concatenate(self.first_bankruptcy or [np.empty(0)])
+        broke = first[first >= 0]
+
+        return {
+            'games': self.games,
+            'turns': self.turns,
+            'properties': [
+                {
+                    'id': i,
+                    'landing_freq': float(
+                        self.landings[i] / max(self.landings.sum(), 1)
+                    ),
+                    'purchases': int(self.purchases[i]),
+                    'rent_income': int(self.rent_income[i]),
+                    'roi': float(self.rent_income[i] / spent[i])
+                    if spent[i] else None
+                }
+                for i in range(len(BOARD))
+            ],
+            'bankruptcy': {
+                'rate': float(len(broke) / max(len(first), 1)),
+                'mean_turn': float(broke.mean()) if len(broke) else None,
+                'median_turn': float(np.median(broke))
+                if len(broke) else None
+            }
+        }
+
+
+def board_arrays(
+    board: Optional[list[dict]] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    # prices and base rents, from BOARD or an override file
+    fields = board or [p.to_dict() for p in BOARD]
+    prices = np.array([f['price'] for f in fields], np.int64)
+    rents = np.array([f['rent'][0] for f in fields], np.int64)
+    return prices, rents
+
+
+def simulate(
+    games: int,
+    players: int,
+    turns: int,
+    rng: np.random.Generator,
+    prices: np.ndarray,
+    rents: np.ndarray,
+    buy_chance: float = 1.0,
+    charge_rent: bool = True,
+    report: Optional[Report] = None,
+    dice: Optional[np.ndarray] = None
+) -> tuple[Report, dict[str, np.ndarray]]:
+    # plays `games` games side by side, one array row per game;
+    # a turn moves player (turn % players) in every game at once.
+    # `dice` (turns, games, 2) replaces random rolls, for checks
+    report = report or Report()
+    size = len(prices)
+    rows = np.arange(games)
+
+    position = np.zeros((games, players), np.int64)
+    balance = np.full((games, players), START_BALANCE, np.int64)
+    owners = np.full((games, size), NO_OWNER, np.int64)
+    alive = np.ones((games, players), bool)
+    first = np.full(games, -1, np.int64)
+
+    for turn in range(turns):
+        p = turn % players
+        # a game is over once one player is left
+        act = alive[:, p] & (alive.sum(axis=1) > 1)
+
+        roll = dice[turn] if dice is not None \
+            else rng.integers(1, 7, size=(games, 2))
+        steps = roll.sum(axis=1)
+
+        prev = position[:, p]
+        new = (prev + steps) % size
+        passed = act & (prev + steps >= size)
+
+        position[act, p] = new[act]
+        balance[passed, p] += START_BONUS
+        report.landings += np.bincount(new[act], minlength=size)
+
+        owner = owners[rows, new]
+        price = prices[new]
+
+        # purchase_property semantics: free field and enough money
+        buy = act & (owner == NO_OWNER) & (balance[:, p] >= price)
+        if buy_chance < 1.0:
+            buy &= rng.random(games) < buy_chance
+
+        balance[buy, p] -= price[buy]
+        owners[buy, new[buy]] = p
+        report.purchases += np.bincount(new[buy], minlength=size)
+
+        if charge_rent:
+            pay = act & (owner != NO_OWNER) & (owner != p)
+            rent = rents[new]
+
+            balance[pay, p] -= rent[pay]
+            np.add.at(balance, (rows[pay], owner[pay]), rent[pay])
+            report.rent_income += np.bincount(
+                new[pay], weights=rent[pay], minlength=size
+            ).astype(np.int64)
+
+            broke = act & (balance[:, p] < 0)
+            if broke.any():
+                alive[broke, p] = False
+                first[broke & (first < 0)] = turn
+                # fields of a bankrupt player go back to the bank
+                owners[broke[:, None] & (owners == p)] = NO_OWNER
+
+    report.games += games
+    report.turns = turns
+    report.first_bankruptcy.append(first)
+
+    return report, {
+        'position': position,
+        'balance': balance,
+        'owners': owners
+    }
+
+
+def check(seed: int, games: int = 50, players: int = 4,
+          turns: int = 120) -> bool:
+    # replays the same dice through the scalar GameService and
+    # compares final positions, balances and owners
+    from src.apps.games.models import Game, Player
+    from src.apps.games.service import GameService
+
+    rng = np.random.default_rng(seed)
+    dice = rng.integers(1, 7, size=(turns, games, 2))
+    prices, rents = board_arrays()
+
+    _, state = simulate(
+        games, players, turns, rng, prices, rents,
+        charge_rent=False, dice=dice
+    )
+
+    for g in range(games):
+        game = Game.model_construct(
+            max_players=players,
+            players=[Player(player_id=i) for i in range(players)]
+        )
+
+        for turn in range(turns):
+            idx = turn % players
+            GameService.move_player(game, idx, int(dice[turn, g].sum()))
+            GameService.purchase_property(game, idx)
+
+        if [p.position for p in game.players] != \
+                state['position'][g].tolist() or \
+                [p.balance for p in game.players] != \
+                state['balance'][g].tolist() or \
+                game.owners != state['owners'][g].tolist():
+            return False
+
+    return True
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.simulate',
+        description='Monte Carlo simulation of the Monopoly board'
+    )
+    parser.add_argument('--games', type=int, default=100_000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=100_000,
+                        help='games simulated at once (memory bound)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--buy-chance', type=float, default=1.0)
+    parser.add_argument('--no-rent', action='store_true',
+                        help='GameService rules only, nobody pays rent')
+    parser.add_argument('--board', type=str, default=None,
+                        help='JSON list of {price, rent} to try out')
+    parser.add_argument('--output', type=str, default=None,
+                        help='write the report as JSON to this file')
+    parser.add_argument('--check', action='store_true',
+                        help='compare with scalar GameService and exit')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        ok = check(args.seed or 0)
+        print('match' if ok else 'MISMATCH')
+        raise SystemExit(0 if ok else 1)
+
+    board = None
+    if args.board:
+        with open(args.board, 'r', encoding='utf-8') as f:
+            board = json.load(f)
+
+    prices, rents = board_arrays(board)
+    rng = np.random.default_rng(args.seed)
+
+    report = Report()
+    left = args.games
+    while left > 0:
+        batch = min(left, args.batch)
+        simulate(
+            batch, args.players, args.turns, rng, prices, rents,
+            buy_chance=args.buy_chance,
+            charge_rent=not args.no_rent,
+            report=report
+        )
+        left -= batch
+
+    result = report.to_dict(prices)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+    print(f'{"id":>3} {"landing":>8} {"bought":>9} {"rent":>11} {"roi":>7}')
+    for p in result['properties']:
+        roi = f'{p["roi"]:.3f}' if p['roi'] is not None else '-'
+        print(f'{p["id"]:>3} {p["landing_freq"]:>8.4f} '
+              f'{p["purchases"]:>9} {p["rent_income"]:>11} {roi:>7}')
+
+    bankruptcy = result['bankruptcy']
+    print(f'bankruptcy rate: {bankruptcy["rate"]:.3f}, '
+          f'mean turn: {bankruptcy["mean_turn"]}, '
+          f'median turn: {bankruptcy["median_turn"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+
+# config.py needs the S3 credentials to import, none are used here
+os.environ.setdefault('AWS_ACCESS_KEY', 'test')
+os.environ.setdefault('AWS_SECRET_KEY', 'test')
@@ -0,0 +1,10 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from src.simulate import check
+
+
+def test_check_matches_game_service():
+    # the vectorized rules against GameService, with the same dice
+    assert check(seed=1, games=10, turns=60)